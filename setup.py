@@ -25,7 +25,13 @@ setuptools.setup(
         "flask"
     ],
     extras_require= {
-        "dev": ["pytest", "setuptools", "wheel"]
+        "dev": ["pytest", "setuptools", "wheel"],
+        "columnar": ["pyarrow"],
+        "compression": ["brotli"],
+        "binary": ["msgpack", "cbor2"]
+    },
+    entry_points={
+        "console_scripts": ["trident-dashboard=trident.server:main"]
     },
     include_package_data=True,
     zip_safe=False
@@ -9,7 +9,31 @@ Tests the logic for the Trident Dashboard backend.
 
 import pytest
 
-from tests.fixture.client import client, tired_panda, round_giraffe, find_file_result, improved_find_file_result, cool_kitten
+import csv
+import json
+import gzip
+from io import BytesIO
+from os import fork, waitpid, _exit, path
+from datetime import datetime, timedelta
+from threading import Barrier, Event, Thread
+from time import sleep
+from unittest.mock import patch
+
+from flask import Response
+from sqlalchemy import event
+
+import trident.backend.columnar
+import trident.backend.compress
+import trident.backend.result
+import trident.backend.snapshot
+import trident.backend.trident
+import trident.database.handler
+from trident.backend.limit import get_limits, RateLimiter, NO_REFILL_RETRY_AFTER
+from trident.backend.payload import decode_payload, CHUNK_SIZE
+from trident.backend.schema import Schema, daemon_schema, result_schema
+from trident.database.models import database, ResultIndex
+from trident.database.handler import create_schema, retrieve_record, SingleFlight
+from tests.fixture.client import client, app, database_path, file_app, workers, tired_panda, round_giraffe, find_file_result, improved_find_file_result, cool_kitten
 
 
 def test_dashboard_smoke(client):
@@ -308,3 +332,857 @@ def test_delete_results_plugin_index(client):
 
     response = client.get("/result/{}/find-file/1".format(daemon))
     assert response.status_code == 200
+
+def test_init_database_command(file_app):
+    """ Test create the database schema of a persistent database using the 'init-db' command. """
+    result = file_app.test_cli_runner().invoke(args=["init-db"])
+    assert result.exit_code == 0
+
+    client = file_app.test_client()
+    response = client.post("/trident/connect", json=tired_panda)
+    assert response.status_code == 201
+
+def test_engine_disposed_after_fork(file_app):
+    """ Test that a forked worker replaces the connection pool inherited from the parent process. """
+    with file_app.app_context():
+        create_schema()
+        retrieve_record(tablename="Daemon").all()
+        pool = database.engine.pool
+
+        pid = fork()
+        if pid == 0:
+            try:
+                database.session.remove()
+                assert database.engine.pool is not pool
+                retrieve_record(tablename="Daemon").all()
+            except BaseException:
+                _exit(1)
+            _exit(0)
+
+        _, status = waitpid(pid, 0)
+        assert status == 0
+        assert database.engine.pool is pool
+
+def test_retrieve_result_diff(client):
+    """ Test retrieve the difference between the results at two indexes for a specific plugin for a given daemon. """
+    response = client.post("/trident/connect", json=tired_panda)
+    assert response.status_code == 201
+
+    daemon = response.get_json()["daemon"]
+    response = client.post("/result/{}/find-file/0".format(daemon), json=find_file_result)
+    assert response.status_code == 201
+
+    response = client.post("/result/{}/find-file/1".format(daemon), json=improved_find_file_result)
+    assert response.status_code == 201
+
+    response = client.get("/result/{}/find-file/diff?from=0&to=1".format(daemon))
+    assert response.status_code == 200
+    assert response.get_json()["diff"] == {"added": {}, "removed": {}, "changed": {"1": {"from": None, "to": "file1.html"}}}
+
+    response = client.get("/result/{}/find-file/diff?from=0&to=2".format(daemon))
+    assert response.status_code == 404
+
+    response = client.get("/result/{}/find-file/diff?from=0".format(daemon))
+    assert response.status_code == 400
+
+def test_retrieve_result_diff_after_delete(client):
+    """ Test that a memoized difference is invalidated when one of its results is deleted. """
+    response = client.post("/trident/connect", json=tired_panda)
+    assert response.status_code == 201
+
+    daemon = response.get_json()["daemon"]
+    client.post("/result/{}/find-file/0".format(daemon), json=find_file_result)
+    client.post("/result/{}/find-file/1".format(daemon), json=improved_find_file_result)
+    assert client.get("/result/{}/find-file/diff?from=0&to=1".format(daemon)).status_code == 200
+
+    response = client.delete("/result/{}/find-file/1".format(daemon))
+    assert response.status_code == 202
+
+    response = client.post("/result/{}/find-file/1".format(daemon), json=find_file_result)
+    assert response.status_code == 201
+
+    response = client.get("/result/{}/find-file/diff?from=0&to=1".format(daemon))
+    assert response.get_json()["diff"] == {"added": {}, "removed": {}, "changed": {}}
+
+def test_retrieve_result_diff_across_workers(workers):
+    """ Test that a difference memoized by one worker is not served after its results are changed by another worker. """
+    first, second = (app.test_client() for app in workers)
+    daemon = first.post("/trident/connect", json=tired_panda).get_json()["daemon"]
+    first.post("/result/{}/find-file/0".format(daemon), json=find_file_result)
+    first.post("/result/{}/find-file/1".format(daemon), json=improved_find_file_result)
+
+    diff = first.get("/result/{}/find-file/diff?from=0&to=1".format(daemon)).get_json()["diff"]
+    assert diff != {"added": {}, "removed": {}, "changed": {}}
+
+    assert second.delete("/result/{}/find-file/1".format(daemon)).status_code == 202
+    assert second.post("/result/{}/find-file/1".format(daemon), json=find_file_result).status_code == 201
+
+    response = first.get("/result/{}/find-file/diff?from=0&to=1".format(daemon))
+    assert response.get_json()["diff"] == {"added": {}, "removed": {}, "changed": {}}
+
+def test_retrieve_result_diff_non_object(client):
+    """ Test retrieve the difference between list and scalar results, which are compared as a whole. """
+    daemon = client.post("/trident/connect", json=tired_panda).get_json()["daemon"]
+    for index, result in enumerate(([1, 2], 5, "x")):
+        assert client.post("/result/{}/find-file/{}".format(daemon, index), json={"result": result}).status_code == 201
+
+    response = client.get("/result/{}/find-file/diff?from=0&to=1".format(daemon))
+    assert response.status_code == 200
+    assert response.get_json()["diff"] == {"from": [1, 2], "to": 5}
+
+    response = client.get("/result/{}/find-file/diff?from=1&to=2".format(daemon))
+    assert response.get_json()["diff"] == {"from": 5, "to": "x"}
+
+    response = client.get("/result/{}/find-file/changes?since=-1".format(daemon))
+    assert response.status_code == 200
+    assert [change["diff"] for change in response.get_json()["changes"]] == [
+        {"from": None, "to": [1, 2]}, {"from": [1, 2], "to": 5}, {"from": 5, "to": "x"}
+    ]
+
+def test_retrieve_result_changes(client):
+    """ Test retrieve the changes since a given index for a specific plugin for a given daemon, paged by 'limit'
+    and without memoizing the differences.
+    """
+    response = client.post("/trident/connect", json=tired_panda)
+    assert response.status_code == 201
+
+    daemon = response.get_json()["daemon"]
+    client.post("/result/{}/find-file/0".format(daemon), json=find_file_result)
+    client.post("/result/{}/find-file/1".format(daemon), json=improved_find_file_result)
+    client.post("/result/{}/find-file/2".format(daemon), json=improved_find_file_result)
+
+    response = client.get("/result/{}/find-file/changes?since=0".format(daemon)).get_json()
+    assert response["latest"] == 2
+    assert [change["index"] for change in response["changes"]] == [1, 2]
+    assert response["changes"][0]["diff"]["changed"] == {"1": {"from": None, "to": "file1.html"}}
+    assert response["changes"][1]["diff"] == {"added": {}, "removed": {}, "changed": {}}
+
+    response = client.get("/result/{}/find-file/changes?since=-1&limit=2".format(daemon)).get_json()
+    assert response["latest"] == 1
+    assert [change["index"] for change in response["changes"]] == [0, 1]
+
+    response = client.get("/result/{}/find-file/changes?since={}&limit=2".format(daemon, response["latest"])).get_json()
+    assert [change["index"] for change in response["changes"]] == [2]
+    with client.application.app_context():
+        assert len(trident.backend.result.diff_cache()) == 0
+
+    response = client.get("/result/{}/find-file/changes?since=2".format(daemon)).get_json()
+    assert response["changes"] == []
+
+    response = client.get("/result/{}/find-file/changes".format(daemon))
+    assert response.status_code == 400
+
+def test_search_results(client):
+    """ Test search the values of the results of all daemons. """
+    daemons = []
+    for daemon in (tired_panda, round_giraffe):
+        response = client.post("/trident/connect", json=daemon)
+        assert response.status_code == 201
+        daemons.append(response.get_json()["daemon"])
+
+    response = client.post("/result/{}/find-file/0".format(daemons[0]), json=find_file_result)
+    assert response.status_code == 201
+
+    response = client.post("/result/{}/improved-find-file/0".format(daemons[1]), json=improved_find_file_result)
+    assert response.status_code == 201
+
+    response = client.get("/result/search?q=file2.html")
+    assert response.status_code == 200
+    assert {(match["daemon"], match["plugin"], match["key"]) for match in response.get_json()} == {
+        (daemons[0], "find-file", "2"), (daemons[1], "improved-find-file", "2")
+    }
+
+    response = client.get("/result/search?q=file&daemon={}".format(daemons[1]))
+    assert {match["value"] for match in response.get_json()} == {"file1.html", "file2.html"}
+
+    response = client.get("/result/search?q=file1&plugin=find-file")
+    assert response.get_json() == []
+
+    response = client.get("/result/search")
+    assert response.status_code == 400
+
+def test_search_results_after_delete(client):
+    """ Test that deleted results are removed from the search index. """
+    response = client.post("/trident/connect", json=tired_panda)
+    assert response.status_code == 201
+
+    daemon = response.get_json()["daemon"]
+    client.post("/result/{}/find-file/0".format(daemon), json=find_file_result)
+    client.post("/result/{}/find-file/1".format(daemon), json=improved_find_file_result)
+
+    response = client.delete("/result/{}/find-file/1".format(daemon))
+    assert response.status_code == 202
+
+    response = client.get("/result/search?q=file")
+    assert [(match["index"], match["value"]) for match in response.get_json()] == [(0, "file2.html")]
+
+def test_search_results_stores_values_once(client):
+    """ Test that the value of a key is stored once however many terms it has and that repeated keys are indexed. """
+    daemon = client.post("/trident/connect", json=tired_panda).get_json()["daemon"]
+    value = " ".join(f"word{number}" for number in range(100))
+    response = client.post("/result/{}/find-file/0".format(daemon), json={"result": {"text": value, "a.b": "first", "a": {"b": "second"}}})
+    assert response.status_code == 201
+
+    with client.application.app_context():
+        assert retrieve_record(tablename="ResultValue", daemon=daemon, key="text").count() == 1
+        assert retrieve_record(tablename="ResultIndex", daemon=daemon, key="text").count() == ResultIndex.MAX_TERMS
+        assert "value" not in ResultIndex.__table__.columns
+
+    response = client.get("/result/search?q=word20")
+    assert [match["value"] for match in response.get_json()] == [value]
+    matches = client.get("/result/search?q=first").get_json() + client.get("/result/search?q=second").get_json()
+    assert [match["key"] for match in matches] == ["a.b"]
+
+    response = client.delete("/result/{}/find-file/0".format(daemon))
+    assert response.status_code == 202
+    with client.application.app_context():
+        assert retrieve_record(tablename="ResultValue", daemon=daemon).count() == 0
+
+def test_search_results_uses_index(client):
+    """ Test that the queries issued by searching the results are answered using the index on the terms. """
+    daemon = client.post("/trident/connect", json=tired_panda).get_json()["daemon"]
+    client.post("/result/{}/find-file/0".format(daemon), json={"result": {"path": "/srv/www/file2.html"}})
+
+    statements = []
+    def record_statement(connection, cursor, statement, parameters, context, executemany):
+        if "FROM result_index" in statement:
+            statements.append((statement, parameters))
+
+    with client.application.app_context():
+        engine = database.engine
+    event.listen(engine, "before_cursor_execute", record_statement)
+    try:
+        for arguments in ("", "&daemon={}".format(daemon), "&daemon={}&plugin=find-file".format(daemon)):
+            response = client.get("/result/search?q=file2.html" + arguments)
+            assert [match["value"] for match in response.get_json()] == ["/srv/www/file2.html"]
+    finally:
+        event.remove(engine, "before_cursor_execute", record_statement)
+
+    assert len(statements) == 3
+    with client.application.app_context():
+        for statement, parameters in statements:
+            plan = database.session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+            assert any("term>? AND term<?" in str(row) for row in plan), plan
+
+@pytest.mark.parametrize("app", [{"RATE_LIMIT_RATE": 0.1, "RATE_LIMIT_BURST": 2}], indirect=True)
+def test_rate_limit_results(app):
+    """ Test that a daemon exceeding its rate of writes is rejected without affecting other daemons. """
+    client = app.test_client()
+    daemons = [client.post("/trident/connect", json=daemon).get_json()["daemon"] for daemon in (tired_panda, round_giraffe)]
+
+    for index in range(2):
+        response = client.post("/result/{}/find-file/{}".format(daemons[0], index), json=find_file_result)
+        assert response.status_code == 201
+
+    response = client.post("/result/{}/find-file/2".format(daemons[0]), json=find_file_result)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+    response = client.post("/result/{}/improved-find-file/0".format(daemons[1]), json=improved_find_file_result)
+    assert response.status_code == 201
+
+@pytest.mark.parametrize("app", [{"RATE_LIMIT_RATE": 0, "RATE_LIMIT_BURST": 1}], indirect=True)
+def test_rate_limit_without_refill(app):
+    """ Test that a rate of 0 never refills the bucket of a daemon and is rejected with a fixed 'Retry-After'. """
+    client = app.test_client()
+    daemon = client.post("/trident/connect", json=tired_panda).get_json()["daemon"]
+
+    response = client.post("/result/{}/find-file/0".format(daemon), json=find_file_result)
+    assert response.status_code == 201
+
+    response = client.post("/result/{}/find-file/1".format(daemon), json=find_file_result)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(NO_REFILL_RETRY_AFTER)
+
+    with pytest.raises(ValueError):
+        RateLimiter(rate=-1, burst=1)
+
+@pytest.mark.parametrize("app", [{"WRITE_CONCURRENCY": 1, "WRITE_CONCURRENCY_TIMEOUT": 0}], indirect=True)
+def test_write_concurrency_limit(app):
+    """ Test that writes are rejected when too many writes are in progress. """
+    client = app.test_client()
+    _, semaphore = get_limits(app)
+
+    semaphore.acquire()
+    response = client.post("/trident/connect", json=tired_panda)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+
+    semaphore.release()
+    response = client.post("/trident/connect", json=tired_panda)
+    assert response.status_code == 201
+
+@pytest.mark.parametrize("app", [{"QUERY_PROFILING": True, "SLOW_QUERY_THRESHOLD": 0}], indirect=True)
+def test_query_profiling(app, caplog):
+    """ Test that the queries of a request, of the generation of the daemon and of the daemon, are recorded
+    and slow queries are logged with their query plan.
+    """
+    client = app.test_client()
+    daemon = client.post("/trident/connect", json=tired_panda).get_json()["daemon"]
+
+    response = client.get("/trident/{}".format(daemon))
+    assert response.status_code == 200
+    assert int(response.headers["X-Query-Count"]) == 2
+
+    record, = [
+        record for record in app.extensions["trident_query_statistics"].serialize
+        if record["endpoint"] == "trident.daemon" and "FROM generation" not in record["statement"]
+    ]
+    assert record["count"] == 1 and record["rows"] == 1
+    assert any("Slow query" in message and "plan" in message for message in caplog.messages)
+
+@pytest.mark.parametrize("app", [{"QUERY_PROFILING": True, "N_PLUS_ONE_THRESHOLD": 3}], indirect=True)
+def test_query_profiling_n_plus_one(app, caplog):
+    """ Test that lazily loading the relationships of many daemons within a request is reported as N+1. """
+    client = app.test_client()
+    for _ in range(3):
+        client.post("/trident/connect", json=tired_panda)
+
+    with app.test_request_context("/trident/connected"):
+        for daemon in retrieve_record(tablename="Daemon").all():
+            daemon.daemon_plugin_rel
+        app.process_response(Response())
+
+    assert any(record["n_plus_one"] == 1 for record in app.extensions["trident_query_statistics"].serialize)
+    assert any("N+1" in message for message in caplog.messages)
+
+@pytest.mark.parametrize("app", [{"QUERY_PROFILING": True}], indirect=True)
+def test_retrieve_daemon_overview(app):
+    """ Test retrieve the overview of a daemon with its plugins and latest results using at most two queries,
+    besides the query of the generation of the daemon which is the only query of a cached overview.
+    """
+    client = app.test_client()
+    daemon = client.post("/trident/connect", json=tired_panda).get_json()["daemon"]
+    for index in range(3):
+        client.post("/result/{}/find-file/{}".format(daemon, index), json=find_file_result)
+    client.post("/result/{}/scan-hosts-file/0".format(daemon), json=improved_find_file_result)
+
+    response = client.get("/trident/{}/overview?latest=2".format(daemon))
+    assert response.status_code == 200
+    assert int(response.headers["X-Query-Count"]) <= 3
+
+    overview = response.get_json()
+    assert overview["daemon"]["daemon"] == daemon
+    assert {plugin["plugin_name"] for plugin in overview["plugins"]} == {"find-file", "scan-hosts-file"}
+    assert [result["index"] for result in overview["results"]["find-file"]] == [2, 1]
+    assert [result["index"] for result in overview["results"]["scan-hosts-file"]] == [0]
+
+    response = client.get("/trident/{}/overview?latest=2".format(daemon))
+    assert response.get_json() == overview
+    assert int(response.headers["X-Query-Count"]) == 1
+
+    client.post("/result/{}/find-file/3".format(daemon), json=improved_find_file_result)
+    response = client.get("/trident/{}/overview?latest=2".format(daemon))
+    assert [result["index"] for result in response.get_json()["results"]["find-file"]] == [3, 2]
+
+def test_retrieve_daemon_overview_across_workers(workers):
+    """ Test that an overview cached by one worker is not served after a result is posted to another worker. """
+    first, second = (app.test_client() for app in workers)
+    daemon = first.post("/trident/connect", json=tired_panda).get_json()["daemon"]
+    first.post("/result/{}/find-file/0".format(daemon), json=find_file_result)
+    response = first.get("/trident/{}/overview".format(daemon))
+    assert [result["index"] for result in response.get_json()["results"]["find-file"]] == [0]
+
+    assert second.post("/result/{}/find-file/1".format(daemon), json=find_file_result).status_code == 201
+    response = first.get("/trident/{}/overview".format(daemon))
+    assert [result["index"] for result in response.get_json()["results"]["find-file"]] == [1, 0]
+
+def test_retrieve_non_existant_daemon_overview(client):
+    """ Test retrieve the overview of a daemon that does not exist. """
+    response = client.get("/trident/tired-panda/overview")
+    assert response.status_code == 404
+
+    response = client.get("/trident/tired-panda/overview?latest=zero")
+    assert response.status_code == 400
+
+def test_retrieve_latest_result(client):
+    """ Test retrieve the latest result for a specific plugin for a given daemon. """
+    response = client.post("/trident/connect", json=tired_panda)
+    assert response.status_code == 201
+
+    daemon = response.get_json()["daemon"]
+    response = client.get("/result/{}/find-file/latest".format(daemon))
+    assert response.status_code == 404
+
+    client.post("/result/{}/find-file/1".format(daemon), json=improved_find_file_result)
+    client.post("/result/{}/find-file/0".format(daemon), json=find_file_result)
+
+    response, = client.get("/result/{}/find-file/latest".format(daemon)).get_json()
+    assert response["index"] == 1
+    assert response["result"]["1"] == "file1.html"
+
+    client.post("/result/{}/find-file/2".format(daemon), json=find_file_result)
+    response, = client.get("/result/{}/find-file/latest".format(daemon)).get_json()
+    assert response["index"] == 2
+
+def test_retrieve_latest_result_after_delete(client):
+    """ Test that the latest result falls back to the previous result when the latest result is deleted. """
+    response = client.post("/trident/connect", json=tired_panda)
+    assert response.status_code == 201
+
+    daemon = response.get_json()["daemon"]
+    client.post("/result/{}/find-file/0".format(daemon), json=find_file_result)
+    client.post("/result/{}/find-file/1".format(daemon), json=improved_find_file_result)
+
+    response = client.delete("/result/{}/find-file/1".format(daemon))
+    assert response.status_code == 202
+
+    response, = client.get("/result/{}/find-file/latest".format(daemon)).get_json()
+    assert response["index"] == 0
+
+    response = client.delete("/result/{}/find-file".format(daemon))
+    assert response.status_code == 202
+
+    response = client.get("/result/{}/find-file/latest".format(daemon))
+    assert response.status_code == 404
+
+def test_retrieve_result_rollup(client):
+    """ Test retrieve the rollups of the runs and non-null results per daemon and per plugin. """
+
+    response = client.post("/trident/connect", json=tired_panda)
+    assert response.status_code == 201
+
+    daemon = response.get_json()["daemon"]
+    client.post("/result/{}/find-file/0".format(daemon), json=find_file_result)
+    client.post("/result/{}/find-file/1".format(daemon), json={"result": {0: None}})
+    client.post("/result/{}/scan-hosts-file/0".format(daemon), json=improved_find_file_result)
+
+    response = client.get("/result/rollup?daemon={}".format(daemon))
+    assert response.status_code == 200
+    assert response.get_json()["resolution"] == "1m"
+    assert sum(bucket["runs"] for bucket in response.get_json()["buckets"]) == 3
+    assert {bucket["daemon"] for bucket in response.get_json()["buckets"]} == {daemon}
+
+    response = client.get("/result/rollup?by=plugin&resolution=1h").get_json()
+    non_null = {}
+    for bucket in response["buckets"]:
+        non_null[bucket["plugin"]] = non_null.get(bucket["plugin"], 0) + bucket["non_null"]
+    assert non_null == {"find-file": 1, "scan-hosts-file": 1}
+
+    start = (datetime.utcnow() - timedelta(days=30)).isoformat()
+    response = client.get("/result/rollup?start={}".format(start)).get_json()
+    assert response["resolution"] == "1d"
+    assert sum(bucket["runs"] for bucket in response["buckets"]) == 3
+
+    start = (datetime.utcnow() - timedelta(days=30)).isoformat() + "Z"
+    response = client.get("/result/rollup", query_string={"start": start})
+    assert response.status_code == 200
+    assert sum(bucket["runs"] for bucket in response.get_json()["buckets"]) == 3
+
+    end = datetime.utcnow() + timedelta(minutes=1)
+    response = client.get("/result/rollup", query_string={"end": (end + timedelta(hours=2)).isoformat() + "+02:00"})
+    assert response.status_code == 200
+    assert response.get_json()["end"] == end.isoformat()
+    assert sum(bucket["runs"] for bucket in response.get_json()["buckets"]) == 3
+
+    response = client.get("/result/rollup?resolution=1s")
+    assert response.status_code == 400
+
+    response = client.get("/result/rollup?start=yesterday")
+    assert response.status_code == 400
+
+def test_export_import_snapshot(client, app):
+    """ Test export the snapshot of a daemon and import it into another dashboard. """
+
+    response = client.post("/trident/connect", json=tired_panda)
+    assert response.status_code == 201
+
+    daemon = response.get_json()["daemon"]
+    client.post("/result/{}/find-file/0".format(daemon), json=find_file_result)
+    client.post("/result/{}/find-file/1".format(daemon), json=improved_find_file_result)
+
+    response = client.get("/snapshot/{}".format(daemon))
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    snapshot = response.get_data()
+    assert [line["table"] for line in map(json.loads, snapshot.splitlines())] == ["Daemon", "Plugin", "Plugin", "Result", "Result"]
+
+    response = client.get("/snapshot?format=gzip")
+    assert response.status_code == 200
+    assert gzip.decompress(response.get_data()) == snapshot
+
+    target = app.test_client()
+    response = target.post("/snapshot", data=response.get_data(), headers={"Content-Type": "application/gzip"})
+    assert response.status_code == 201
+    assert response.get_json() == {"Daemon": 1, "Plugin": 2, "Result": 2}
+
+    response, = target.get("/result/{}/find-file/latest".format(daemon)).get_json()
+    assert response["index"] == 1
+    assert target.get("/plugin/{}".format(daemon)).status_code == 200
+
+    response = target.post("/snapshot", data=snapshot)
+    assert response.status_code == 201
+    assert response.get_json() == {"Daemon": 0, "Plugin": 0, "Result": 0}
+    assert len(target.get("/plugin/{}".format(daemon)).get_json()) == 2
+
+@pytest.mark.parametrize("app", [{"SNAPSHOT_BATCH_SIZE": 2}], indirect=True)
+def test_import_snapshot_resume(client, app):
+    """ Test that a failed import keeps the committed batches and can be resumed by sending the snapshot again. """
+    daemon = client.post("/trident/connect", json=tired_panda).get_json()["daemon"]
+    client.post("/result/{}/find-file/0".format(daemon), json=find_file_result)
+    client.post("/result/{}/find-file/1".format(daemon), json=improved_find_file_result)
+    snapshot = client.get("/snapshot/{}".format(daemon)).get_data().splitlines()
+
+    target = app.test_client()
+    response = target.post("/snapshot", data=b"\n".join(snapshot[:3] + [b'{"table": "Result"}'] + snapshot[3:]))
+    assert response.status_code == 400
+    assert response.get_data(as_text=True).startswith("Bad Request: line 4: ")
+    assert '"Daemon": 1, "Plugin": 1' in response.get_data(as_text=True)
+
+    response = target.post("/snapshot", data=b"\n".join(snapshot))
+    assert response.status_code == 201
+    assert response.get_json() == {"Daemon": 0, "Plugin": 1, "Result": 2}
+
+@pytest.mark.parametrize("app", [{"SNAPSHOT_MAX_LINE_SIZE": 1024}], indirect=True)
+def test_import_snapshot_line_too_large(client, app):
+    """ Test that the lines of a snapshot are split across reads and that a line exceeding the maximum is rejected
+    before it is decompressed whole.
+    """
+    daemon = client.post("/trident/connect", json=tired_panda).get_json()["daemon"]
+    snapshot = client.get("/snapshot/{}".format(daemon)).get_data()
+    lines = list(trident.backend.snapshot.import_lines(BytesIO(snapshot * 2000)))
+    assert len(lines) == len(snapshot.splitlines()) * 2000
+    assert set(lines) == set(snapshot.splitlines())
+
+    large = snapshot + json.dumps({"table": "Result", "record": {"result": "x" * CHUNK_SIZE * 64}}).encode()
+    with patch.object(trident.backend.snapshot, "CHUNK_SIZE", 4096):
+        lines = trident.backend.snapshot.import_lines(BytesIO(gzip.compress(large)), compressed=True, max_line_size=1024)
+        with pytest.raises(trident.backend.snapshot.LineTooLarge):
+            for _ in lines:
+                pass
+
+    response = app.test_client().post("/snapshot", data=gzip.compress(large), headers={"Content-Type": "application/gzip"})
+    assert response.status_code == 400
+    assert response.get_data(as_text=True).startswith("Bad Request: line {}: ".format(len(snapshot.splitlines()) + 1))
+
+def test_export_non_existant_daemon_snapshot(client):
+    """ Test export the snapshot of a daemon that does not exist. """
+    response = client.get("/snapshot/tired-panda")
+    assert response.status_code == 404
+
+    response = client.get("/snapshot?format=zip")
+    assert response.status_code == 400
+
+def test_export_columnar_results(client):
+    """ Test export the results flattened into typed columns as CSV. """
+
+    response = client.post("/trident/connect", json=tired_panda)
+    assert response.status_code == 201
+
+    daemon = response.get_json()["daemon"]
+    client.post("/result/{}/find-file/0".format(daemon), json=find_file_result)
+    client.post("/result/{}/find-file/1".format(daemon), json={"result": {0: 1, 1: 2.5, 2: True, 3: {"nested": "value"}}})
+
+    response = client.get("/snapshot/columnar?daemon={}".format(daemon))
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+
+    rows = list(csv.DictReader(response.get_data(as_text=True).splitlines()))
+    assert list(rows[0]) == ["daemon", "plugin", "index", "timestamp", "result.0", "result.1", "result.2", "result.3.nested"]
+    assert [row["result.2"] for row in rows] == ["file2.html", "true"]
+    assert [row["result.1"] for row in rows] == ["", "2.5"]
+    assert rows[1]["result.3.nested"] == "value"
+
+    response = client.get("/snapshot/columnar?format=xlsx")
+    assert response.status_code == 400
+
+def test_export_columnar_results_arrow(client):
+    """ Test export the results flattened into typed columns as Arrow and Parquet. """
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    response = client.post("/trident/connect", json=tired_panda)
+    assert response.status_code == 201
+
+    daemon = response.get_json()["daemon"]
+    client.post("/result/{}/find-file/0".format(daemon), json={"result": {0: 1, 1: None}})
+    client.post("/result/{}/find-file/1".format(daemon), json={"result": {0: 2.5, 1: True}})
+
+    table = pyarrow.ipc.open_stream(client.get("/snapshot/columnar?format=arrow").get_data()).read_all()
+    assert table.schema.field("result.0").type == pyarrow.float64()
+    assert table.schema.field("result.1").type == pyarrow.bool_()
+    assert table.column("result.0").to_pylist() == [1.0, 2.5]
+
+    table = pyarrow.parquet.read_table(BytesIO(client.get("/snapshot/columnar?format=parquet").get_data()))
+    assert table.column("result.1").to_pylist() == [None, True]
+
+    paths, mkstemp = [], trident.backend.snapshot.mkstemp
+    def recorded_mkstemp(*args, **kwargs):
+        descriptor, temporary = mkstemp(*args, **kwargs)
+        paths.append(temporary)
+        return descriptor, temporary
+
+    with patch.object(trident.backend.snapshot, "mkstemp", recorded_mkstemp):
+        client.head("/snapshot/columnar?format=parquet").close()
+        client.get("/snapshot/columnar?format=parquet").close()
+    assert len(paths) == 2
+    assert not any(path.exists(temporary) for temporary in paths)
+
+def test_export_results_command(app):
+    """ Test export the results flattened into typed columns using the 'export-results' command. """
+    client = app.test_client()
+    daemon = client.post("/trident/connect", json=tired_panda).get_json()["daemon"]
+    client.post("/result/{}/find-file/0".format(daemon), json=find_file_result)
+
+    result = app.test_cli_runner().invoke(args=["export-results", "--daemon", daemon, "-"])
+    assert result.exit_code == 0
+    assert result.output.splitlines()[1].startswith("{},find-file,0,".format(daemon))
+
+def test_export_columnar_results_inserted_between_passes(app):
+    """ Test that results stored after the columns are collected are not exported, whatever their timestamps,
+    and that values that do not fit the collected columns do not fail the export.
+    """
+    client = app.test_client()
+    daemon = client.post("/trident/connect", json=tired_panda).get_json()["daemon"]
+    client.post("/result/{}/find-file/0".format(daemon), json={"result": {"a": 1}})
+
+    with app.app_context():
+        query = trident.backend.columnar.result_query(daemon)
+        columns = trident.backend.columnar.result_columns(query)
+        assert columns["result.a"] is int
+
+        record = {"index": 1, "plugin_name": "find-file", "daemon": daemon, "result": {"a": "not-an-int", "new": "key"}, "timestamp": "2000-01-01T00:00:00"}
+        assert client.post("/snapshot", data=json.dumps({"table": "Result", "record": record})).status_code == 201
+        rows = [row for batch in trident.backend.columnar.result_batches(query, columns) for row in batch]
+        assert [row["index"] for row in rows] == [0]
+
+        rows = [row for batch in trident.backend.columnar.result_batches(trident.backend.columnar.result_query(daemon), columns) for row in batch]
+        assert [(row["index"], row["result.a"]) for row in rows] == [(0, 1), (1, None)]
+        assert "result.new" not in rows[1]
+
+    result = app.test_cli_runner().invoke(args=["export-results", "--format", "parquet", "-"])
+    assert result.exit_code == 2
+    assert "Parquet can not be written to stdout" in result.output
+
+def test_single_flight_coalesces_concurrent_calls():
+    """ Test that concurrent calls with the same key share one call and later calls are executed again. """
+    single_flight, calls, results = SingleFlight(), [], []
+    def slow_call():
+        calls.append(None)
+        sleep(0.2)
+        return len(calls)
+
+    barrier = Barrier(8)
+    def caller():
+        barrier.wait()
+        results.append(single_flight.do(("Plugin", (("daemon", "tired-panda"),)), slow_call))
+
+    threads = [Thread(target=caller) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [1] * 8
+    assert single_flight.do(("Plugin", (("daemon", "tired-panda"),)), slow_call) == 2
+
+def test_single_flight_shares_errors():
+    """ Test that an error raised by the in-flight call is raised to every caller and not remembered. """
+
+    single_flight = SingleFlight()
+    def failing_call():
+        raise ValueError("Failed")
+
+    with pytest.raises(ValueError):
+        single_flight.do("key", failing_call)
+    assert single_flight.do("key", lambda: "value") == "value"
+
+def test_single_flight_read_after_write(file_app):
+    """ Test that a read arriving after a committed write does not share a read that started before the write. """
+    with file_app.app_context():
+        create_schema()
+
+    client = file_app.test_client()
+    daemon = client.post("/trident/connect", json=tired_panda).get_json()["daemon"]
+    client.post("/result/{}/find-file/0".format(daemon), json=find_file_result)
+
+    retrieve_content, read, release = trident.database.handler.retrieve_content, Event(), Event()
+    def stalled_retrieve_content(tablename, kwargs):
+        content = retrieve_content(tablename, kwargs)
+        if not read.is_set():
+            read.set()
+            release.wait(5)
+        return content
+
+    responses = {}
+    def get(name):
+        responses[name] = file_app.test_client().get("/result/{}".format(daemon)).get_json()
+
+    with patch.object(trident.database.handler, "retrieve_content", stalled_retrieve_content):
+        before = Thread(target=get, args=("before",))
+        before.start()
+        assert read.wait(5)
+
+        assert client.post("/result/{}/find-file/1".format(daemon), json=find_file_result).status_code == 201
+        after = Thread(target=get, args=("after",))
+        after.start()
+        after.join(5)
+        assert not after.is_alive()
+
+        release.set()
+        before.join()
+
+    assert len(responses["before"]) == 1
+    assert len(responses["after"]) == 2
+
+def test_compress_response(client):
+    """ Test that large responses are compressed as negotiated by 'Accept-Encoding' and small responses are not. """
+    daemon = client.post("/trident/connect", json=tired_panda).get_json()["daemon"]
+    for index in range(20):
+        assert client.post(f"/result/{daemon}/find-file/{index}", json=find_file_result).status_code == 201
+
+    identity = client.get(f"/result/{daemon}")
+    assert "Content-Encoding" not in identity.headers
+    assert "Accept-Encoding" in identity.headers["Vary"]
+
+    response = client.get(f"/result/{daemon}", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.get_data()) == identity.get_data()
+    assert response.headers["ETag"] != identity.headers["ETag"]
+
+    response = client.get(f"/result/{daemon}/find-file/0", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert "Content-Encoding" not in response.headers
+
+def test_compress_response_cached(client):
+    """ Test that an unchanged payload is compressed once and that a matching ETag returns 304. """
+    daemon = client.post("/trident/connect", json=tired_panda).get_json()["daemon"]
+    for index in range(20):
+        assert client.post(f"/result/{daemon}/find-file/{index}", json=find_file_result).status_code == 201
+
+    with patch.object(trident.backend.compress, "compress", wraps=trident.backend.compress.compress) as compress:
+        first = client.get(f"/result/{daemon}", headers={"Accept-Encoding": "gzip"})
+        second = client.get(f"/result/{daemon}", headers={"Accept-Encoding": "gzip"})
+        assert compress.call_count == 1
+    assert first.get_data() == second.get_data()
+    assert first.headers["ETag"] == second.headers["ETag"]
+
+    response = client.get(f"/result/{daemon}", headers={"Accept-Encoding": "gzip", "If-None-Match": first.headers["ETag"]})
+    assert response.status_code == 304
+    assert not response.get_data()
+
+@pytest.mark.parametrize("encoding,mimetype", [("msgpack", "application/msgpack"), ("cbor2", "application/cbor")])
+def test_binary_payload(client, encoding, mimetype):
+    """ Test connect a daemon and post a result encoded as MessagePack or CBOR. """
+    module = pytest.importorskip(encoding)
+    encode = module.packb if encoding == "msgpack" else module.dumps
+
+    response = client.post("/trident/connect", data=encode(tired_panda), content_type=mimetype)
+    assert response.status_code == 201
+    daemon = response.get_json()["daemon"]
+
+    response = client.post(f"/result/{daemon}/find-file/0", data=encode(find_file_result), content_type=mimetype)
+    assert response.status_code == 201
+    assert client.get(f"/result/{daemon}/find-file/0").get_json()[0]["result"] == {"0": None, "1": None, "2": "file2.html"}
+
+    response = client.post(f"/result/{daemon}/find-file/1", data=encode(find_file_result)[:-4], content_type=mimetype)
+    assert response.status_code == 400
+
+    response = client.post(f"/result/{daemon}/find-file/1", data=encode(find_file_result) * 2, content_type=mimetype)
+    assert response.status_code == 400
+
+def test_unsupported_payload(client):
+    """ Test that payloads of unsupported content types are rejected. """
+    daemon = client.post("/trident/connect", json=tired_panda).get_json()["daemon"]
+    response = client.post(f"/result/{daemon}/find-file/0", data=json.dumps(find_file_result), content_type="text/plain")
+    assert response.status_code == 415
+
+    response = client.post(f"/result/{daemon}/find-file/0", data="{", content_type="application/json")
+    assert response.status_code == 400
+
+def test_binary_payload_streamed():
+    """ Test that a MessagePack payload is decoded while the stream is read and not buffered whole. """
+    msgpack = pytest.importorskip("msgpack")
+
+    class Stream(BytesIO):
+        reads = []
+        def read(self, size=-1):
+            self.reads.append(size)
+            return super().read(size)
+
+    data = msgpack.packb({"result": {str(key): "file.html" * 10 for key in range(10000)}})
+    assert decode_payload(Stream(data), "application/msgpack")["result"]["9999"] == "file.html" * 10
+    assert all(0 < size <= CHUNK_SIZE for size in Stream.reads)
+    assert len(Stream.reads) > len(data) // CHUNK_SIZE
+
+def test_schema_errors():
+    """ Test that the compiled schemas report every invalid value by its path. """
+    validate = daemon_schema({"DAEMON_MAX_PLUGINS": 1}).compile()
+    assert validate(tired_panda) == ["arguments.plugins: exceeds 1 items"]
+    assert validate({**round_giraffe, "worker_count": True, "host_addr": "192.168.100.100.1"}) == [
+        "host_addr: exceeds 15 characters",
+        "worker_count: expected an integer, got bool"
+    ]
+    assert validate([]) == ["payload: expected an object, got list"]
+
+    validate = daemon_schema({}).compile()
+    assert validate(cool_kitten) == ["host_addr: is required"]
+    assert validate({**tired_panda, "arguments": {"plugins": {"find-file": None}}}) == ["arguments.plugins.find-file: expected an object, got null"]
+    assert validate({"daemon": "tired-panda"}) == []
+    assert validate({"daemon": "tired-panda", "worker_count": -1}) == ["worker_count: must be at least 0"]
+    assert validate({"daemon": None}) == ["host_addr: is required", "worker_count: is required"]
+
+    with pytest.raises(TypeError):
+        Schema()
+
+    validate = result_schema({"RESULT_MAX_DEPTH": 2, "RESULT_MAX_VALUES": 10, "RESULT_MAX_STRING_LENGTH": 4}).compile()
+    assert validate(find_file_result) == ["result.2: exceeds 4 characters"]
+    assert validate({"result": {"a": {"b": {"c": 1}}}}) == ["result.a.b: exceeds a depth of 2"]
+    assert validate({"result": list(range(10))}) == ["result: exceeds 10 values"]
+    assert validate({"result": {"a": [1.0, float("nan")]}}) == ["result.a.1: expected a finite number, got nan"]
+    assert validate({"result": {"a": b"file"}}) == ["result.a: expected a JSON value, got bytes"]
+    assert validate({"result": None}) == ["result: expected a value, got null"]
+    assert validate({}) == ["result: is required"]
+
+def test_invalid_payload_rejected(client):
+    """ Test that invalid and oversized payloads are rejected with their errors before the database is used. """
+    with patch.object(trident.backend.trident, "retrieve_record") as retrieve:
+        response = client.post("/trident/connect", json=cool_kitten)
+        assert response.status_code == 400
+        assert response.get_data(as_text=True) == "Bad Request: host_addr: is required"
+
+        response = client.post("/trident/connect", json={**tired_panda, "worker_count": "5"})
+        assert response.status_code == 400
+        assert "worker_count: expected an integer, got str" in response.get_data(as_text=True)
+        assert not retrieve.called
+
+    daemon = client.post("/trident/connect", json=tired_panda).get_json()["daemon"]
+    with patch.object(trident.backend.result, "retrieve_record") as retrieve:
+        response = client.post(f"/result/{daemon}/find-file/0", data='{"result": {"0": NaN}}', content_type="application/json")
+        assert response.status_code == 400
+        assert response.get_data(as_text=True) == "Bad Request: result.0: expected a finite number, got nan"
+
+        response = client.post(f"/result/{daemon}/find-file/first", json=find_file_result)
+        assert response.status_code == 400
+        assert response.get_data(as_text=True) == "Bad Request: index: expected an integer"
+        assert not retrieve.called
+
+    client.application.config["RESULT_MAX_SIZE"] = 16
+    response = client.post(f"/result/{daemon}/find-file/0", json=find_file_result)
+    assert response.status_code == 413
+
+    def post_chunked(index):
+        return client.post(
+            f"/result/{daemon}/find-file/{index}", input_stream=BytesIO(json.dumps(find_file_result).encode()),
+            content_type="application/json", headers={"Transfer-Encoding": "chunked"}, environ_overrides={"wsgi.input_terminated": True}
+        )
+
+    assert post_chunked(0).status_code == 413
+    client.application.config["RESULT_MAX_SIZE"] = 1024
+    assert post_chunked(0).status_code == 201
+
+def test_generated_daemon_name_fits_schema(client):
+    """ Test that generated daemon names longer than the daemon name column are discarded so the daemon can reconnect
+    by its name alone.
+    """
+    with patch.object(trident.backend.trident, "choice", side_effect=["incomprehensible\n", "rhino\n", "tired\n", "panda\n"]):
+        response = client.post("/trident/connect", json=tired_panda)
+    assert response.status_code == 201
+    assert response.get_json()["daemon"] == "tired-panda"
+
+    assert client.delete("/trident/disconnect/tired-panda").status_code == 202
+    response = client.post("/trident/connect", json={"daemon": "tired-panda"})
+    assert response.status_code == 201
+    assert daemon_schema({}).compile()({**tired_panda, "daemon": "incomprehensible-rhino"}) == ["daemon: exceeds 20 characters"]
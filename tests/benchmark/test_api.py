@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Trident: Test API Module.
+Benchmarks the throughput and latency of the Trident Dashboard API using synthetic daemon fleets.
+
+@author: Jacob Wahlman
+"""
+
+import pytest
+
+from threading import Barrier, Thread
+from time import perf_counter
+
+from tests.fixture.client import tired_panda, database_path
+from tests.fixture.benchmark import benchmark_app, benchmark_target, benchmark_file_app, generate_fleet, generate_result, measure, report, ROWS
+from trident.database.models import database, Result
+
+
+def connect(client, daemon=tired_panda):
+    """ Connect a daemon to the dashboard and return its name. """
+    response = client.post("/trident/connect", json=daemon)
+    assert response.status_code == 201
+    return response.get_json()["daemon"]
+
+def seed_results(app, daemon, rows, size=3, chunk=10000):
+    """ Insert results for the 'find-file' plugin of a daemon directly into the database in chunks. """
+    result = generate_result(size)["result"]
+    with app.app_context():
+        for start in range(0, rows, chunk):
+            database.session.add_all([
+                Result(index=index, plugin_name="find-file", result=result, daemon=daemon)
+                for index in range(start, min(rows, start + chunk))
+            ])
+            database.session.commit()
+
+def test_benchmark_connect_storm(benchmark_app):
+    """ Benchmark a fleet of daemons connecting to the dashboard at the same time. """
+    client = benchmark_app.test_client()
+    fleet = generate_fleet(500)
+
+    def connect_daemon(iteration):
+        assert client.post("/trident/connect", json=fleet[iteration]).status_code == 201
+
+    report("connect_storm", measure(connect_daemon, len(fleet)))
+
+@pytest.mark.parametrize("size", [1, 100, 1000])
+def test_benchmark_ingest(benchmark_app, size):
+    """ Benchmark the ingest of results with the given amount of entries per result. """
+    client = benchmark_app.test_client()
+    daemon = connect(client)
+    payload = generate_result(size)
+
+    def post_result(iteration):
+        assert client.post(f"/result/{daemon}/find-file/{iteration}", json=payload).status_code == 201
+
+    report(f"ingest_batch_{size}", measure(post_result, 200), operations=200 * size)
+
+@pytest.mark.parametrize("rows", ROWS)
+def test_benchmark_read_results(benchmark_app, rows):
+    """ Benchmark reading all results of a daemon with the given amount of result rows. """
+    client = benchmark_app.test_client()
+    daemon = connect(client)
+    seed_results(benchmark_app, daemon, rows)
+
+    def read_results(iteration):
+        response = client.get(f"/result/{daemon}")
+        assert response.status_code == 200
+        assert len(response.get_json()) == rows
+
+    report(f"read_results_{rows}", measure(read_results, 5), operations=5 * rows)
+
+@pytest.mark.parametrize("rows", ROWS)
+def test_benchmark_delete_results(benchmark_app, rows):
+    """ Benchmark deleting all results of a daemon with the given amount of result rows. """
+    client = benchmark_app.test_client()
+    daemon = connect(client)
+    seed_results(benchmark_app, daemon, rows)
+
+    def delete_results(iteration):
+        assert client.delete(f"/result/{daemon}").status_code == 202
+
+    report(f"delete_results_{rows}", measure(delete_results, 1), operations=rows)
+    assert client.get(f"/result/{daemon}").status_code == 404
+
+@pytest.mark.parametrize("rows", ROWS)
+def test_benchmark_read_latest_result(benchmark_app, rows):
+    """ Benchmark reading the latest result of a plugin of a daemon with the given amount of result rows. """
+    client = benchmark_app.test_client()
+    daemon = connect(client)
+    seed_results(benchmark_app, daemon, rows)
+
+    def read_latest_result(iteration):
+        response = client.get(f"/result/{daemon}/find-file/latest")
+        assert response.get_json()[0]["index"] == rows - 1
+
+    report(f"read_latest_result_{rows}", measure(read_latest_result, 200))
+
+@pytest.mark.parametrize("rows", ROWS)
+def test_benchmark_snapshot(benchmark_app, benchmark_target, rows):
+    """ Benchmark exporting a compressed snapshot with the given amount of result rows and importing it again. """
+    client = benchmark_app.test_client()
+    daemon = connect(client)
+    seed_results(benchmark_app, daemon, rows)
+
+    snapshot = []
+    def export_snapshot(iteration):
+        response = client.get("/snapshot?format=gzip")
+        assert response.status_code == 200
+        snapshot.append(response.get_data())
+
+    report(f"export_snapshot_{rows}", measure(export_snapshot, 1), operations=rows)
+
+    target = benchmark_target.test_client()
+    def import_snapshot(iteration):
+        assert target.post("/snapshot", data=snapshot[0], headers={"Content-Type": "application/gzip"}).status_code == 201
+
+    report(f"import_snapshot_{rows}", measure(import_snapshot, 1), operations=rows)
+
+@pytest.mark.parametrize("rows", ROWS)
+def test_benchmark_columnar_export(benchmark_app, rows):
+    """ Benchmark exporting the results flattened into typed columns as CSV with the given amount of result rows. """
+    client = benchmark_app.test_client()
+    daemon = connect(client)
+    seed_results(benchmark_app, daemon, rows, size=100)
+
+    def export_columnar(iteration):
+        response = client.get("/snapshot/columnar?format=csv")
+        assert len(response.get_data().splitlines()) == rows + 1
+
+    report(f"columnar_export_{rows}", measure(export_columnar, 1), operations=rows)
+
+def test_benchmark_coalesced_reads(benchmark_file_app):
+    """ Benchmark a thundering herd of identical reads and the amount of queries they cause. """
+    app = benchmark_file_app
+    daemon = connect(app.test_client())
+    seed_results(app, daemon, ROWS[0])
+
+    clients = 50
+    barrier, samples = Barrier(clients), []
+    def read_results():
+        client = app.test_client()
+        barrier.wait()
+        samples.extend(measure(lambda iteration: client.get(f"/result/{daemon}"), 1))
+
+    threads = [Thread(target=read_results) for _ in range(clients)]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - start
+
+    queries = sum(
+        record["count"] for record in app.extensions["trident_query_statistics"].serialize
+        if record["endpoint"] == "result.results" and record["statement"].lstrip().startswith("SELECT")
+        and "FROM generation" not in record["statement"]
+    )
+    print(f"coalesced_reads: {clients} requests caused {queries} queries")
+    report("coalesced_reads", samples, elapsed=elapsed)
+    assert queries < clients
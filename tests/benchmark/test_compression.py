@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Trident: Test Compression Module.
+Benchmarks the CPU cost of compressing typical result payloads against the bytes saved by every encoding.
+
+@author: Jacob Wahlman
+"""
+
+import pytest
+
+import gzip
+
+from tests.fixture.benchmark import benchmark_app, measure, report, ROWS
+from tests.benchmark.test_api import connect, seed_results
+from trident.backend.compress import brotli
+
+ENCODINGS = [("gzip", 1), ("gzip", 6), ("gzip", 9), ("br", 1), ("br", 5), ("br", 9)]
+
+
+def compress(data, encoding, level):
+    """ Compress the data using the encoding at the given level or quality. """
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+@pytest.mark.parametrize("rows", ROWS)
+@pytest.mark.parametrize("encoding,level", ENCODINGS)
+def test_benchmark_compression(benchmark_app, rows, encoding, level):
+    """ Benchmark compressing the results of a daemon, the throughput is in MiB per second, and print the bytes saved. """
+    if encoding == "br" and brotli is None:
+        pytest.skip("Brotli requires the 'brotli' package")
+
+    client = benchmark_app.test_client()
+    daemon = connect(client)
+    seed_results(benchmark_app, daemon, rows, size=10)
+    data = client.get(f"/result/{daemon}").get_data()
+
+    compressed = []
+    samples = measure(lambda iteration: compressed.append(compress(data, encoding, level)), 5)
+    saved = 1 - len(compressed[0]) / len(data)
+    print(f"compress_{encoding}_{level}_{rows}: {len(data)} to {len(compressed[0])} bytes, {saved:.1%} saved")
+    report(f"compress_{encoding}_{level}_{rows}", samples, operations=5 * len(data) / 2 ** 20)
+
+@pytest.mark.parametrize("rows", ROWS)
+def test_benchmark_compressed_reads(benchmark_app, rows):
+    """ Benchmark repeated compressed reads of an unchanged payload, which are served from the compressed cache. """
+    client = benchmark_app.test_client()
+    daemon = connect(client)
+    seed_results(benchmark_app, daemon, rows, size=10)
+
+    def read_results(iteration):
+        response = client.get(f"/result/{daemon}", headers={"Accept-Encoding": "br, gzip"})
+        assert response.headers["Content-Encoding"] in ("br", "gzip")
+
+    report(f"compressed_reads_{rows}", measure(read_results, 20), operations=20 * rows)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Trident: Test Payload Module.
+Benchmarks the cost of decoding result payloads encoded as JSON, MessagePack and CBOR and of validating them.
+
+@author: Jacob Wahlman
+"""
+
+import pytest
+
+import json
+from io import BytesIO
+
+from tests.fixture.benchmark import benchmark_app, generate_result, measure, report
+from tests.benchmark.test_api import connect
+from trident.backend.payload import decode_payload
+from trident.backend.schema import result_schema
+
+ENCODINGS = {
+    "json": ("application/json", lambda: lambda data: json.dumps(data).encode()),
+    "msgpack": ("application/msgpack", lambda: pytest.importorskip("msgpack").packb),
+    "cbor": ("application/cbor", lambda: pytest.importorskip("cbor2").dumps)
+}
+
+
+@pytest.mark.parametrize("size", [100, 10000])
+@pytest.mark.parametrize("encoding", list(ENCODINGS))
+def test_benchmark_decode_payload(encoding, size):
+    """ Benchmark decoding a result with the given amount of entries, the throughput is in entries per second. """
+    mimetype, encoder = ENCODINGS[encoding]
+    data = encoder()(generate_result(size))
+
+    def decode(iteration):
+        assert len(decode_payload(BytesIO(data), mimetype)["result"]) == size
+
+    print(f"decode_{encoding}_{size}: {len(data)} bytes")
+    report(f"decode_{encoding}_{size}", measure(decode, 50), operations=50 * size)
+
+@pytest.mark.parametrize("size", [100, 10000])
+def test_benchmark_validate_payload(size):
+    """ Benchmark validating a result with the given amount of entries, the throughput is in entries per second. """
+    validate = result_schema({}).compile()
+    payload = generate_result(size)
+
+    def validate_payload(iteration):
+        assert not validate(payload)
+
+    report(f"validate_{size}", measure(validate_payload, 50), operations=50 * size)
+
+@pytest.mark.parametrize("encoding", list(ENCODINGS))
+def test_benchmark_ingest_payload(benchmark_app, encoding):
+    """ Benchmark the ingest of results with 1000 entries per result in the given encoding. """
+    mimetype, encoder = ENCODINGS[encoding]
+    client = benchmark_app.test_client()
+    daemon = connect(client)
+    data = encoder()(generate_result(1000))
+
+    def post_result(iteration):
+        response = client.post(f"/result/{daemon}/find-file/{iteration}", data=data, content_type=mimetype)
+        assert response.status_code == 201
+
+    report(f"ingest_{encoding}_1000", measure(post_result, 100), operations=100 * 1000)
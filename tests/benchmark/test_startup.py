@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Trident: Test Startup Module.
+Benchmarks the import and startup time of the Trident Dashboard.
+
+@author: Jacob Wahlman
+"""
+
+import pytest
+
+import sys
+from os import environ
+from subprocess import run
+
+IMPORT_TIME_BUDGET = float(environ.get("TRIDENT_IMPORT_TIME_BUDGET", 1.0))
+FIRST_REQUEST_BUDGET = float(environ.get("TRIDENT_FIRST_REQUEST_BUDGET", 3.0))
+
+
+def run_python(*args):
+    """ Run a Python interpreter with the given arguments and return the completed process. """
+    process = run([sys.executable, *args], capture_output=True, text=True)
+    assert process.returncode == 0, process.stderr
+    return process
+
+def test_import_has_no_side_effects():
+    """ Test that importing the package does not create the application or import the database. """
+    process = run_python("-c", (
+        "import sys, trident;"
+        "print('app' in vars(trident));"
+        "print(any(module.startswith(('trident.backend', 'trident.database', 'flask_sqlalchemy')) for module in sys.modules))"
+    ))
+    assert process.stdout.split() == ["False", "False"]
+
+def test_import_time():
+    """ Benchmark the cumulative import time of the package using '-X importtime'. """
+    process = run_python("-X", "importtime", "-c", "import trident")
+    cumulative, = [
+        int(line.split("|")[1]) for line in process.stderr.splitlines()
+        if line.startswith("import time:") and line.split("|")[2].strip() == "trident"
+    ]
+    print(f"import trident: {cumulative / 1e6:.3f}s")
+    assert cumulative / 1e6 < IMPORT_TIME_BUDGET
+
+def test_time_to_first_request():
+    """ Benchmark the time from interpreter start until the first request has been served. """
+    process = run_python("-c", (
+        "from time import perf_counter;"
+        "start = perf_counter();"
+        "from trident import create_app;"
+        "response = create_app({'TESTING': True}).test_client().get('/status');"
+        "assert response.status_code == 200;"
+        "print(perf_counter() - start)"
+    ))
+    elapsed = float(process.stdout)
+    print(f"time to first request: {elapsed:.3f}s")
+    assert elapsed < FIRST_REQUEST_BUDGET
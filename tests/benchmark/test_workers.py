@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Trident: Test Workers Module.
+Benchmarks the throughput of the pre-forked multi-worker serving mode.
+
+@author: Jacob Wahlman
+"""
+
+import pytest
+
+import sys
+import json
+import signal
+from os import cpu_count, environ
+from subprocess import Popen, PIPE, run
+from threading import Thread
+from time import perf_counter
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+from trident import create_app
+from trident.database.handler import create_schema
+from tests.fixture.client import tired_panda, database_path
+
+DURATION = float(environ.get("TRIDENT_BENCHMARK_DURATION", 2.0))
+WORKERS = max(2, min(4, cpu_count() or 1))
+
+
+@pytest.fixture
+def database_uri(database_path):
+    with create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{database_path}"}).app_context():
+        create_schema()
+    return f"sqlite:///{database_path}"
+
+def start_server(database_uri, workers, env=None):
+    """ Start the pre-forking server in a subprocess and return the process and its base URL.
+    If no database URI is given then it is configured by the environment variables.
+    """
+    database = ["--database", database_uri] if database_uri else []
+    process = Popen(
+        [sys.executable, "-m", "trident.server", "--port", "0", "--workers", str(workers), *database],
+        stdout=PIPE, text=True, env={**environ, **(env or {})}
+    )
+    url = process.stdout.readline().split()[2]
+    return process, url
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    process.wait(timeout=10)
+
+def request(url, data=None):
+    """ Send a request to the dashboard and return the decoded JSON response. """
+    body = None if data is None else json.dumps(data).encode()
+    with urlopen(Request(url, data=body, headers={"Content-Type": "application/json"}), timeout=10) as response:
+        return json.loads(response.read() or "null")
+
+def throughput(url, clients, duration=DURATION):
+    """ Measure the amount of requests per second served to the given amount of concurrent clients. """
+    counts = [0] * clients
+    deadline = perf_counter() + duration
+
+    def client(identifier):
+        while perf_counter() < deadline:
+            request(url)
+            counts[identifier] += 1
+
+    threads = [Thread(target=client, args=(identifier,)) for identifier in range(clients)]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / (perf_counter() - start)
+
+def test_workers_serve_requests(database_uri):
+    """ Test that writes in one worker are visible to reads in every other worker. """
+    process, url = start_server(database_uri, WORKERS)
+    try:
+        daemon = request(f"{url}/trident/connect", tired_panda)["daemon"]
+        for _ in range(WORKERS * 4):
+            response, = request(f"{url}/trident/{quote(daemon)}")
+            assert response["daemon"] == daemon
+    finally:
+        stop_server(process)
+
+def test_workers_database_from_environment(database_uri):
+    """ Test that the database configured by the 'FLASK_' prefixed environment variables is shared by the workers. """
+    process, url = start_server(None, WORKERS, env={"FLASK_SQLALCHEMY_DATABASE_URI": database_uri})
+    try:
+        daemon = request(f"{url}/trident/connect", tired_panda)["daemon"]
+        response, = request(f"{url}/trident/{quote(daemon)}")
+        assert response["daemon"] == daemon
+    finally:
+        stop_server(process)
+
+def test_workers_failing_to_start():
+    """ Test that the server stops with a non-zero status when the workers keep failing to start. """
+    process = run(
+        [sys.executable, "-m", "trident.server", "--port", "0", "--workers", "2", "--database", "invalid://"],
+        capture_output=True, text=True, timeout=60
+    )
+    assert process.returncode == 1
+    assert "NoSuchModuleError" in process.stderr
+    assert "failed to start" in process.stderr
+
+def test_workers_throughput(database_uri):
+    """ Benchmark the read throughput of a single worker against multiple workers. """
+    results = {}
+    for workers in (1, WORKERS):
+        process, url = start_server(database_uri, workers)
+        try:
+            daemon = request(f"{url}/trident/connect", tired_panda)["daemon"]
+            results[workers] = throughput(f"{url}/plugin/{quote(daemon)}", clients=workers * 2)
+        finally:
+            stop_server(process)
+
+    print(f"throughput: 1 worker {results[1]:.0f} req/s, {WORKERS} workers {results[WORKERS]:.0f} req/s ({cpu_count()} cores)")
+    assert results[WORKERS] > results[1] * 0.5
+    if (cpu_count() or 1) >= WORKERS:
+        assert results[WORKERS] > results[1] * 1.2
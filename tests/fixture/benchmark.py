@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Trident: Benchmark Fixture Module.
+Contains the synthetic daemon fleets, measurements and baselines used by the benchmarks.
+
+Baselines are stored in 'tests/benchmark/baselines.json' and updated by running the benchmarks
+with 'TRIDENT_BENCHMARK_UPDATE=1', a benchmark fails if its throughput drops below 'TRIDENT_BENCHMARK_TOLERANCE'
+of its baseline. The row counts are given by 'TRIDENT_BENCHMARK_ROWS', e.g. '10000,100000,1000000'.
+
+@author: Jacob Wahlman
+"""
+
+import pytest
+
+import json
+from copy import deepcopy
+from os import environ, path
+from time import perf_counter
+
+from trident import create_app
+from trident.database.handler import create_schema
+from tests.fixture.client import tired_panda, find_file_result, database_path
+
+BASELINES = path.join(path.dirname(path.dirname(path.abspath(__file__))), "benchmark", "baselines.json")
+TOLERANCE = float(environ.get("TRIDENT_BENCHMARK_TOLERANCE", 0.25))
+ROWS = [int(rows) for rows in environ.get("TRIDENT_BENCHMARK_ROWS", "1000").split(",")]
+
+
+def generate_fleet(count, template=tired_panda):
+    """ Generate a fleet of daemons from a daemon template, every daemon gets an unique host address. """
+    fleet = []
+    for number in range(count):
+        daemon = deepcopy(template)
+        daemon["host_addr"] = f"10.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}"
+        fleet.append(daemon)
+    return fleet
+
+def generate_result(size, template=find_file_result):
+    """ Generate a result with the given amount of entries by repeating the values of a result template. """
+    values = list(template["result"].values())
+    return {"result": {str(key): values[key % len(values)] for key in range(size)}}
+
+def percentile(samples, fraction):
+    """ Return the value at the given fraction of the sorted samples. """
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def measure(func, iterations):
+    """ Call the function the given amount of times and return the latency of every call in seconds. """
+    samples = []
+    for iteration in range(iterations):
+        start = perf_counter()
+        func(iteration)
+        samples.append(perf_counter() - start)
+    return samples
+
+def report(name, samples, operations=None, elapsed=None):
+    """ Report the throughput and latency percentiles of a benchmark and compare them to its baseline.
+    The throughput is the amount of operations per second, by default one operation per sample,
+    over the elapsed time which defaults to the sum of the samples for benchmarks that are not concurrent.
+    """
+    result = {
+        "throughput": round((operations or len(samples)) / (elapsed or sum(samples)), 1),
+        "p50": round(percentile(samples, 0.50) * 1000, 3),
+        "p95": round(percentile(samples, 0.95) * 1000, 3),
+        "p99": round(percentile(samples, 0.99) * 1000, 3)
+    }
+    print(f"{name}: {result['throughput']} ops/s, p50 {result['p50']}ms, p95 {result['p95']}ms, p99 {result['p99']}ms")
+
+    baselines = {}
+    if path.exists(BASELINES):
+        with open(BASELINES, "r") as baselines_file:
+            baselines = json.load(baselines_file)
+
+    if environ.get("TRIDENT_BENCHMARK_UPDATE"):
+        baselines[name] = result
+        with open(BASELINES, "w") as baselines_file:
+            json.dump(baselines, baselines_file, indent=4, sort_keys=True)
+            baselines_file.write("\n")
+    elif name in baselines:
+        assert result["throughput"] >= baselines[name]["throughput"] * TOLERANCE, (
+            f"'{name}' regressed from {baselines[name]['throughput']} ops/s to {result['throughput']} ops/s"
+        )
+
+    return result
+
+@pytest.fixture
+def benchmark_app():
+    return create_app({
+        "TESTING": True,
+        "RATE_LIMIT_ENABLED": False
+    })
+
+@pytest.fixture
+def benchmark_target():
+    """ A second empty application, e.g. to import a snapshot exported from 'benchmark_app' into. """
+    return create_app({
+        "TESTING": True,
+        "RATE_LIMIT_ENABLED": False
+    })
+
+@pytest.fixture
+def benchmark_file_app(database_path):
+    """ An application with a file database and its schema created that profiles its queries, so concurrent requests use their own connections. """
+    app = create_app({
+        "TESTING": True,
+        "RATE_LIMIT_ENABLED": False,
+        "QUERY_PROFILING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{database_path}"
+    })
+    with app.app_context():
+        create_schema()
+    return app
@@ -13,6 +13,7 @@ from os import close, unlink
 from tempfile import mkstemp
 
 from trident import create_app
+from trident.database.handler import create_schema
 from trident.database.models import database
 
 tired_panda = {
@@ -102,4 +103,37 @@ def client():
     return create_app({
         "TESTING": True,
         "DATABASE": path
-    }).test_client()
\ No newline at end of file
+    }).test_client()
+
+@pytest.fixture
+def app(request):
+    """ An application with an in-memory database, the configuration is extended by indirect parametrisation. """
+    return create_app({
+        "TESTING": True,
+        **getattr(request, "param", {})
+    })
+
+@pytest.fixture
+def database_path():
+    """ The path of a temporary file database that is removed after the test. """
+    descriptor, path = mkstemp()
+    close(descriptor)
+    yield path
+    unlink(path)
+
+@pytest.fixture
+def workers(database_path):
+    """ Two applications sharing a file database with its schema created, like two workers of the pre-forking server. """
+    apps = [create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": f"sqlite:///{database_path}"}) for _ in range(2)]
+    with apps[0].app_context():
+        create_schema()
+    return apps
+
+@pytest.fixture
+def file_app(request, database_path):
+    """ An application with a file database without a schema, the configuration is extended by indirect parametrisation. """
+    return create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{database_path}",
+        **getattr(request, "param", {})
+    })
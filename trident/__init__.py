@@ -5,36 +5,98 @@ from os import environ, path
 from logging import DEBUG, INFO
 ROOT_DIR = path.dirname(path.abspath(__file__))
 
+import click
 from flask import Flask
+from flask.cli import with_appcontext
 
-from trident.database.models import database
-import trident.backend.result
-import trident.backend.plugin
-import trident.backend.trident
-import trident.backend.dashboard
 
+def load_config(app_config, config=None):
+    """ Load the defaults, then the 'FLASK_' prefixed environment variables and then the given config into the config. """
+    app_config.from_mapping(
+        SECRET_KEY='dev',
+        SQLALCHEMY_DATABASE_URI="sqlite:///:memory:",
+        SQLALCHEMY_TRACK_MODIFICATIONS=False
+    )
+    app_config.from_prefixed_env()
+    if config is not None:
+        app_config.update(config)
+    return app_config
 
 def create_app(config=None) -> Flask:
-    """ Create and configure the Flask application. """
+    """ Create and configure the Flask application.
+    Importing the blueprints and the database models is deferred until the application is created,
+    so that importing 'trident' has no side effects. The database schema is only created here for
+    in-memory databases, persistent databases are initialized using the 'init-db' command.
+    """
+    from trident.database.models import database
+    from trident.database.handler import create_schema, configure_engine, MEMORY_DATABASE_URIS
+    from trident.database.profiler import init_profiler
+    from trident.backend.compress import init_compression
+    from trident.backend.schema import init_schemas
+    import trident.backend.result
+    import trident.backend.plugin
+    import trident.backend.trident
+    import trident.backend.dashboard
+    import trident.backend.snapshot
+
     debug = True if environ.get("FLASK_ENV", "production") == "development" else False
     app = Flask(__name__, instance_relative_config=True, template_folder="templates")
-    app.config.from_mapping(
-        SECRET_KEY='dev'
-    )
+    load_config(app.config, config)
     app.logger.setLevel(DEBUG if debug else INFO)
 
-    if config is not None:
-        app.config.update(config)
-
     database.init_app(app)
-    with app.app_context():
-        database.create_all()
+    configure_engine(app)
+    init_profiler(app)
+    init_compression(app)
+    init_schemas(app)
+    if app.config["SQLALCHEMY_DATABASE_URI"] in MEMORY_DATABASE_URIS:
+        with app.app_context():
+            create_schema()
 
     app.register_blueprint(trident.backend.result.blueprint)
     app.register_blueprint(trident.backend.plugin.blueprint)
     app.register_blueprint(trident.backend.trident.blueprint)
     app.register_blueprint(trident.backend.dashboard.blueprint)
-    
+    app.register_blueprint(trident.backend.snapshot.blueprint)
+
+    app.cli.add_command(init_database_command)
+    app.cli.add_command(export_results_command)
+
     return app
 
-app = create_app()
\ No newline at end of file
+@click.command("init-db")
+@with_appcontext
+def init_database_command():
+    """ Create the database tables used by the dashboard. """
+    from trident.database.handler import create_schema
+    create_schema()
+    click.echo("Initialized the database.")
+
+@click.command("export-results")
+@click.option("--format", "export_format", type=click.Choice(["csv", "arrow", "parquet"]), default="csv", help="Format of the export")
+@click.option("--daemon", default=None, help="Only export the results of the daemon")
+@click.option("--plugin", default=None, help="Only export the results of the plugin")
+@click.argument("output", type=click.Path(dir_okay=False, allow_dash=True))
+@with_appcontext
+def export_results_command(export_format, daemon, plugin, output):
+    """ Export the results flattened into typed columns to OUTPUT, '-' writes CSV and Arrow to stdout but not Parquet. """
+    from trident.backend.columnar import available, export_results
+    if not available(export_format):
+        raise click.UsageError(f"Exporting '{export_format}' requires the 'pyarrow' package")
+    if export_format == "parquet" and output == "-":
+        raise click.UsageError("Parquet can not be written to stdout, OUTPUT must be a path")
+
+    if export_format == "parquet":
+        export_results(export_format, output, daemon=daemon, plugin_name=plugin)
+    else:
+        with click.open_file(output, "wb") as output_file:
+            export_results(export_format, output_file, daemon=daemon, plugin_name=plugin)
+
+def __getattr__(name):
+    """ Lazily create the module level 'app' on first access, e.g. when served as 'trident:app'. """
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Trident: Cache Module.
+Bounded in-memory caches used by the backend endpoints.
+
+The caches are stored on the application and are therefore per-process, so entries are keyed by the generation of
+their daemon read from the database to stay correct when other processes change the underlying records.
+Caches of daemon records are also evicted locally once a transaction that changed their daemons is committed.
+
+@author: Jacob Wahlman
+"""
+
+from collections import OrderedDict
+from threading import Lock
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from trident.database.models import Generation
+
+
+class LRUCache:
+    """ Bounded least recently used cache that is safe to use from multiple threads. """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._records = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, key):
+        return key in self._records
+
+    def get(self, key, default=None):
+        """ Get the value for the key and mark it as the most recently used, if it does not exist return the default. """
+        with self._lock:
+            try:
+                self._records.move_to_end(key)
+            except KeyError:
+                return default
+            return self._records[key]
+
+    def set(self, key, value):
+        """ Set the value for the key and evict the least recently used keys if the cache is full. """
+        with self._lock:
+            self._records[key] = value
+            self._records.move_to_end(key)
+            while len(self._records) > self.maxsize:
+                self._records.popitem(last=False)
+
+    def invalidate(self, predicate):
+        """ Remove all keys that the predicate returns true for. """
+        with self._lock:
+            for key in [key for key in self._records if predicate(key)]:
+                del self._records[key]
+
+    def clear(self):
+        """ Remove all keys from the cache. """
+        with self._lock:
+            self._records.clear()
+
+
+def get_cache(name, maxsize=1024, app=None, daemon=False):
+    """ Get the named cache of the application, the cache is created on first use.
+    If 'daemon' then the keys of the cache start with a daemon and the entries of a daemon are evicted
+    when a transaction that changed the daemon is committed.
+    """
+    app = app or current_app
+    caches = app.extensions.setdefault("trident_caches", {})
+    if name not in caches:
+        caches[name] = LRUCache(maxsize=maxsize)
+        if daemon:
+            app.extensions.setdefault("trident_daemon_caches", []).append(caches[name])
+    return caches[name]
+
+@event.listens_for(Session, "after_commit")
+def evict_daemon_caches(session):
+    """ Evict the entries of the daemons changed by a committed transaction from the caches of daemon records. """
+    changed = Generation.changed(session)
+    if changed and has_app_context():
+        for cache in current_app.extensions.get("trident_daemon_caches", ()):
+            cache.invalidate(lambda key: key[0] in changed)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Trident: Columnar Module.
+Handles the flattening of results into typed columns and writing them as CSV, Arrow or Parquet.
+
+The results are read twice in batches, first to collect the columns and their types and then to write the rows,
+so only the columns and one batch of rows are kept in memory. Both passes only read the rows of the results stored
+before the export started, bounded by the SQLite row id, and values of results changed in between that do not fit
+the collected columns are left out of the rows or written as null. Arrow and Parquet require the optional 'pyarrow' package.
+
+@author: Jacob Wahlman
+"""
+
+import csv
+from io import StringIO, BytesIO
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from sqlalchemy import func, literal_column
+
+from trident.database.models import Result
+
+FORMATS = ("csv", "arrow", "parquet")
+COLUMNS = {"daemon": str, "plugin": str, "index": int, "timestamp": str}
+ROWID = literal_column("result.rowid")
+
+
+def available(export_format):
+    """ Return whether the format can be written, Arrow and Parquet require 'pyarrow'. """
+    return export_format == "csv" or (export_format in FORMATS and pyarrow is not None)
+
+def export_results(export_format, output, daemon=None, plugin_name=None, batch_size=10000):
+    """ Write the flattened results of the daemon and plugin, or of all daemons and plugins, to the output.
+    The output is a binary file object, or a path when writing Parquet.
+    """
+    query = result_query(daemon, plugin_name)
+    columns = result_columns(query, batch_size)
+    batches = result_batches(query, columns, batch_size)
+    if export_format == "parquet":
+        write_parquet(batches, columns, output)
+        return
+
+    for chunk in (write_csv if export_format == "csv" else write_arrow)(batches, columns):
+        output.write(chunk)
+
+def flatten(value, key="result"):
+    """ Yield the column name and value of every scalar in a result, names of nested values are joined by '.'. """
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        yield key, value
+        return
+
+    for item_key, item_value in items:
+        yield from flatten(item_value, f"{key}.{item_key}")
+
+def merge_type(previous, current):
+    """ Return the narrowest type that can represent values of both types, integers and floats are widened to floats. """
+    if previous is None or previous is current:
+        return current
+    if {previous, current} <= {int, float}:
+        return float
+    return str
+
+def convert(value, column_type):
+    """ Convert a value to the type of its column, booleans in string columns are written as in JSON.
+    A value that does not fit its column, e.g. of a result changed since the columns were collected, is written as null.
+    """
+    if value is None or type(value) is column_type:
+        return value
+    if column_type is str:
+        return str(value).lower() if isinstance(value, bool) else str(value)
+    if column_type is float and type(value) is int:
+        return float(value)
+    return None
+
+def result_query(daemon=None, plugin_name=None):
+    """ Return the query of the results to export ordered by daemon, plugin and run index.
+    The query is bounded by the largest row id of the results stored until now, so the results inserted while
+    exporting are not read whatever their timestamps, e.g. of an imported snapshot.
+    """
+    filters = {key: value for key, value in (("daemon", daemon), ("plugin_name", plugin_name)) if value is not None}
+    latest = Result.query.with_entities(func.max(ROWID)).select_from(Result).filter_by(**filters).scalar()
+    return Result.query.filter_by(**filters).filter(ROWID <= latest).order_by(Result.daemon, Result.plugin_name, Result.index)
+
+def result_columns(query, batch_size=10000):
+    """ Collect the typed columns of the flattened results, columns that are only null are typed as strings. """
+    columns = {}
+    for record in query.yield_per(batch_size):
+        for key, value in flatten(record.result):
+            columns[key] = columns.get(key) if value is None else merge_type(columns.get(key), type(value))
+
+    return {**COLUMNS, **{key: value_type or str for key, value_type in columns.items()}}
+
+def result_batches(query, columns, batch_size=10000):
+    """ Yield batches of flattened result rows where every value is converted to the type of its column.
+    Values of keys that are not in the columns, e.g. of a result changed since the columns were collected, are skipped.
+    """
+    batch = []
+    for record in query.yield_per(batch_size):
+        row = {"daemon": record.daemon, "plugin": record.plugin_name, "index": record.index, "timestamp": record.timestamp.isoformat()}
+        for key, value in flatten(record.result):
+            if key in columns:
+                row[key] = convert(value, columns[key])
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+def write_csv(batches, columns):
+    """ Yield the rows as CSV with a header, null values are written as empty fields. """
+    buffer = StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(columns), lineterminator="\n")
+    writer.writeheader()
+    for batch in batches:
+        writer.writerows({key: str(value).lower() if isinstance(value, bool) else value for key, value in row.items()} for row in batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def arrow_schema(columns):
+    """ Return the Arrow schema of the typed columns. """
+    types = {bool: pyarrow.bool_(), int: pyarrow.int64(), float: pyarrow.float64(), str: pyarrow.string()}
+    return pyarrow.schema([(key, types[value_type]) for key, value_type in columns.items()])
+
+def arrow_batch(batch, schema):
+    """ Return a batch of rows as an Arrow record batch of the schema. """
+    return pyarrow.RecordBatch.from_pylist(batch, schema=schema)
+
+def write_arrow(batches, columns):
+    """ Yield the rows as an Arrow IPC stream with one record batch per batch of rows. """
+    if pyarrow is None:
+        raise RuntimeError("Writing Arrow requires the 'pyarrow' package")
+
+    schema, sink = arrow_schema(columns), BytesIO()
+    with pyarrow.ipc.new_stream(sink, schema) as writer:
+        for batch in batches:
+            writer.write_batch(arrow_batch(batch, schema))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+
+    yield sink.getvalue()
+
+def write_parquet(batches, columns, path):
+    """ Write the rows to a Parquet file with one row group per batch of rows. """
+    if pyarrow is None:
+        raise RuntimeError("Writing Parquet requires the 'pyarrow' package")
+
+    schema = arrow_schema(columns)
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for batch in batches:
+            writer.write_batch(arrow_batch(batch, schema))
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Trident: Compress Module.
+Handles the compression of responses negotiated using the 'Accept-Encoding' header of the request.
+
+Responses are compressed using brotli, if the optional 'brotli' package is installed, or gzip when they are larger
+than 'COMPRESS_MIN_SIZE' bytes. Every response is given an ETag from the digest of its content and the compressed
+content is cached by digest and encoding, so an unchanged payload is never compressed again.
+
+@author: Jacob Wahlman
+"""
+
+import gzip
+from hashlib import blake2b
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from flask import current_app, request
+
+from trident.backend.cache import get_cache
+
+COMPRESSIBLE_MIMETYPES = ("application/json", "text/html", "text/plain", "text/csv", "application/javascript")
+
+
+def encodings():
+    """ Return the supported content encodings in order of preference. """
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+def compress(data, encoding):
+    """ Compress the data using the given content encoding. """
+    if encoding == "br":
+        return brotli.compress(data, quality=current_app.config.get("COMPRESS_BROTLI_QUALITY", 5))
+    return gzip.compress(data, compresslevel=current_app.config.get("COMPRESS_LEVEL", 6), mtime=0)
+
+def compress_response(response):
+    """ Compress the response and set its ETag, streamed, unsuccessful and already encoded responses are left as is.
+    If the ETag matches the 'If-None-Match' header of the request then the response is turned into '304'.
+    """
+    if (
+        not current_app.config.get("COMPRESS_ENABLED", True) or response.status_code != 200 or
+        response.is_streamed or response.direct_passthrough or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    data = response.get_data()
+    digest = blake2b(data, digest_size=16).hexdigest()
+    encoding = None
+    if len(data) >= current_app.config.get("COMPRESS_MIN_SIZE", 1024) and response.mimetype in COMPRESSIBLE_MIMETYPES:
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(encodings())
+
+    if encoding is not None:
+        cache = get_cache("compressed_responses", maxsize=current_app.config.get("COMPRESS_CACHE_SIZE", 256))
+        compressed = cache.get((digest, encoding))
+        if compressed is None:
+            compressed = compress(data, encoding)
+            cache.set((digest, encoding), compressed)
+
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        digest = f"{digest}-{encoding}"
+
+    if not response.get_etag()[0]:
+        response.set_etag(digest)
+    return response.make_conditional(request)
+
+def init_compression(app):
+    """ Register the compression of the responses of the application. """
+    app.after_request(compress_response)
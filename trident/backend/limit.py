@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Trident: Limit Module.
+Handles the rate limiting and admission control of the endpoints that write to the database.
+
+Every daemon is given a token bucket that refills at 'RATE_LIMIT_RATE' tokens per second up to 'RATE_LIMIT_BURST' tokens,
+and at most 'WRITE_CONCURRENCY' write requests are handled at the same time. Both are kept in memory per process.
+A rate of 0 never refills the buckets, a daemon can then only write 'RATE_LIMIT_BURST' times per process.
+
+@author: Jacob Wahlman
+"""
+
+from collections import OrderedDict
+from functools import wraps
+from math import ceil
+from threading import Lock, BoundedSemaphore
+from time import monotonic
+
+from flask import current_app, request, make_response
+
+NO_REFILL_RETRY_AFTER = 3600
+
+
+class TokenBucket:
+    """ Token bucket that refills continuously at a given rate up to its capacity. """
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, capacity, now):
+        self.tokens = capacity
+        self.updated = now
+
+    def consume(self, rate, capacity, now):
+        """ Consume a token, returns 0 if a token was available otherwise the seconds until one is.
+        If the rate is 0 then no token will ever be available and 'NO_REFILL_RETRY_AFTER' is returned.
+        """
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+
+        return (1 - self.tokens) / rate if rate > 0 else NO_REFILL_RETRY_AFTER
+
+
+class RateLimiter:
+    """ Per-key token buckets, the least recently used buckets are evicted when there are more than 'maxkeys'. """
+
+    def __init__(self, rate, burst, maxkeys=10000):
+        if rate < 0 or burst < 0:
+            raise ValueError(f"The rate limit rate and burst must not be negative, got rate: {rate} and burst: {burst}")
+        self.rate = rate
+        self.burst = burst
+        self.maxkeys = maxkeys
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def acquire(self, key):
+        """ Acquire a token for the key, returns 0 if the request is admitted otherwise the seconds to wait. """
+        now = monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.burst, now)
+                if len(self._buckets) > self.maxkeys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.consume(self.rate, self.burst, now)
+
+
+def get_limits(app=None):
+    """ Get the rate limiter and the write concurrency semaphore of the application, created on first use. """
+    app = app or current_app
+    limits = app.extensions.get("trident_limits")
+    if limits is None:
+        limits = app.extensions["trident_limits"] = (
+            RateLimiter(rate=app.config.get("RATE_LIMIT_RATE", 10), burst=app.config.get("RATE_LIMIT_BURST", 50)),
+            BoundedSemaphore(app.config.get("WRITE_CONCURRENCY", 4))
+        )
+    return limits
+
+def too_many_requests(retry_after):
+    """ Return a '429' response that tells the client to retry after the given amount of seconds. """
+    response = make_response("Too Many Requests", 429)
+    response.headers["Retry-After"] = str(max(1, ceil(retry_after)))
+    return response
+
+def limit_decorator(func, scope):
+    """ Used by endpoints that write to the backend database tables to limit the rate and concurrency of writes.
+    The rate is limited per daemon given by the endpoint, or per client address if the endpoint has no daemon.
+    If the daemon has no tokens left or too many writes are in progress then the decorator will return '429'
+    Otherwise the endpoint is called and its response is returned.
+    """
+    @wraps(func)
+    def decorator(*args, **kwargs):
+        if not current_app.config.get("RATE_LIMIT_ENABLED", True):
+            return func(*args, **kwargs)
+
+        limiter, semaphore = get_limits()
+        retry_after = limiter.acquire((scope, kwargs.get("daemon", request.remote_addr)))
+        if retry_after:
+            current_app.logger.warning(f"Rate limited write to: '{scope}' with parameters: '{kwargs}'")
+            return too_many_requests(retry_after)
+
+        if not semaphore.acquire(timeout=current_app.config.get("WRITE_CONCURRENCY_TIMEOUT", 0.5)):
+            current_app.logger.warning(f"Rejected write to: '{scope}' with parameters: '{kwargs}', too many concurrent writes")
+            return too_many_requests(1)
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            semaphore.release()
+
+    return decorator
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Trident: Payload Module.
+Handles the decoding of request payloads sent by Trident daemons in the format given by the 'Content-Type' header.
+
+Payloads are accepted as JSON, or as the compact binary MessagePack and CBOR encodings if the optional 'msgpack'
+and 'cbor2' packages are installed. Binary payloads are decoded incrementally while the request body is read,
+so a large upload is never buffered whole before it is parsed.
+
+@author: Jacob Wahlman
+"""
+
+import io
+import json
+
+from flask import request, current_app, make_response
+from werkzeug.exceptions import RequestEntityTooLarge
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+CHUNK_SIZE = 64 * 1024
+MAX_ERRORS = 10
+
+
+class SizedStream(io.IOBase):
+    """ Stream of a request body without a 'Content-Length', e.g. a chunked body, that counts the bytes read.
+    Reading more than 'max_size' bytes raises 'RequestEntityTooLarge' and marks the stream as 'exceeded',
+    so a large body is rejected and not truncated even if a decoder wraps the error.
+    """
+
+    def __init__(self, stream, max_size):
+        self.stream, self.max_size, self.size = stream, max_size, 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        remaining = self.max_size - self.size + 1
+        data = self.stream.read(remaining if size is None or size < 0 or size > remaining else size)
+        self.size += len(data)
+        if self.exceeded:
+            raise RequestEntityTooLarge()
+        return data
+
+    @property
+    def exceeded(self):
+        return self.size > self.max_size
+
+
+def decode_json(stream):
+    """ Decode a JSON payload from the stream. """
+    return json.load(stream)
+
+def decode_msgpack(stream):
+    """ Decode a MessagePack payload from the stream, the stream is read in chunks of 'CHUNK_SIZE' bytes.
+    Integer map keys are allowed since results are keyed by index, they are stored as strings like in JSON.
+    """
+    unpacker = msgpack.Unpacker(stream, read_size=CHUNK_SIZE, raw=False, strict_map_key=False)
+    try:
+        data = next(unpacker)
+    except StopIteration:
+        raise ValueError("The payload is empty or truncated")
+
+    for _ in unpacker:
+        raise ValueError("The payload contains more than one value")
+    return data
+
+def decode_cbor(stream):
+    """ Decode a CBOR payload from the stream, the stream is read as the values are decoded. """
+    data = cbor2.load(stream)
+    if stream.read(1):
+        raise ValueError("The payload contains more than one value")
+    return data
+
+DECODERS = {
+    "application/json": decode_json,
+    "application/msgpack": decode_msgpack,
+    "application/x-msgpack": decode_msgpack,
+    "application/vnd.msgpack": decode_msgpack,
+    "application/cbor": decode_cbor
+}
+
+
+def available(mimetype):
+    """ Return whether payloads of the mimetype can be decoded, MessagePack and CBOR require their optional packages. """
+    decoder = DECODERS.get(mimetype)
+    if decoder is decode_msgpack:
+        return msgpack is not None
+    if decoder is decode_cbor:
+        return cbor2 is not None
+    return decoder is not None
+
+def decode_payload(stream, mimetype):
+    """ Decode the payload of the mimetype from the stream, None is returned if the payload is malformed.
+    The mimetype must be available, see 'available'.
+    """
+    errors = (ValueError, TypeError, EOFError)
+    if msgpack is not None:
+        errors += (msgpack.UnpackException,)
+    if cbor2 is not None:
+        errors += (cbor2.CBORDecodeError,)
+
+    try:
+        return DECODERS[mimetype](stream)
+    except errors:
+        return None
+
+def read_payload(schema, max_size):
+    """ Read the payload of the request and validate it against the compiled schema of the application.
+    Returns the payload and None if it is valid, otherwise None and the response to return:
+    415 if the content type is unsupported, 413 if the payload exceeds 'max_size' bytes
+    and 400 if the payload is malformed or invalid, with the errors of the payload in the content.
+    """
+    if not available(request.mimetype):
+        return None, make_response("Unsupported Media Type", 415)
+
+    if request.content_length is not None and request.content_length > max_size:
+        return None, make_response("Payload Too Large", 413)
+
+    stream = request.stream if request.content_length is not None else SizedStream(request.stream, max_size)
+    try:
+        data = decode_payload(stream, request.mimetype)
+    except RequestEntityTooLarge as e:
+        data = None
+    if isinstance(stream, SizedStream) and stream.exceeded:
+        return None, make_response("Payload Too Large", 413)
+
+    errors = current_app.extensions["trident_schemas"][schema](data) if data is not None else ["payload: is malformed"]
+    if errors:
+        current_app.logger.debug(f"'{request.path}' - Rejected invalid payload with errors: {errors}")
+        return None, make_response("Bad Request: {}".format("; ".join(errors[:MAX_ERRORS])), 400)
+
+    return data, None
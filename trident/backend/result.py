@@ -7,20 +7,188 @@ Handles the logic that fetches and populates the results generated by Trident pl
 @author: Jacob Wahlman
 """
 
+from datetime import datetime, timedelta, timezone
 from functools import partial
 from typing import AnyStr, NewType
 JSON = NewType("JSON", None)
 
-from flask import Blueprint, request, make_response, current_app
+from flask import Blueprint, request, make_response, current_app, jsonify
+from sqlalchemy import and_, func
+from sqlalchemy.exc import SQLAlchemyError
 
+from trident.backend.cache import get_cache
+from trident.backend.limit import limit_decorator
+from trident.backend.payload import read_payload
+from trident.database.models import Result, ResultIndex, ResultValue, ResultRollup, Generation
 from trident.database.handler import retrieve_decorator, insert_decorator, delete_decorator, insert_record, retrieve_record
 
 retrieve_results_record = partial(retrieve_decorator, tablename="Result")
+retrieve_latest_results_record = partial(retrieve_decorator, tablename="LatestResult")
 insert_results_record = partial(insert_decorator, tablename="Result")
 delete_results_record = partial(delete_decorator, tablename="Result")
+limit_results_record = partial(limit_decorator, scope="result")
 blueprint = Blueprint("result", __name__, url_prefix="/result")
 
 
+def diff_results(previous, current) -> JSON:
+    """ Compute the structural difference between two results.
+    Keys only in the current result are 'added', keys only in the previous result are 'removed'
+    and keys with different values are 'changed', nested objects are compared recursively.
+    If either result is not an object, e.g. a list or a scalar, then the difference is its 'from' and 'to' values.
+    """
+    if not isinstance(previous, dict) or not isinstance(current, dict):
+        return {"from": previous, "to": current}
+
+    added = {key: value for key, value in current.items() if key not in previous}
+    removed = {key: value for key, value in previous.items() if key not in current}
+    changed = {}
+    for key in previous.keys() & current.keys():
+        if previous[key] == current[key]:
+            continue
+
+        if isinstance(previous[key], dict) and isinstance(current[key], dict):
+            changed[key] = diff_results(previous[key], current[key])
+        else:
+            changed[key] = {"from": previous[key], "to": current[key]}
+
+    return {"added": added, "removed": removed, "changed": changed}
+
+def diff_result_records(previous, current) -> JSON:
+    """ Compute the difference between two result records, a missing previous record is treated as empty,
+    an empty object if the current result is an object and otherwise null.
+    """
+    if previous is None:
+        return diff_results({} if isinstance(current.result, dict) else None, current.result)
+    return diff_results(previous.result, current.result)
+
+def diff_cache():
+    """ Get the cache of memoized result differences keyed by '(daemon, plugin_name, from, to, generation)'. """
+    return get_cache("result_diff", maxsize=current_app.config.get("RESULT_DIFF_CACHE_SIZE", 1024), daemon=True)
+
+def diff_records(daemon, plugin_name, previous, current, generation) -> JSON:
+    """ Get the memoized difference between two result records, see 'diff_result_records'. """
+    cache = diff_cache()
+    key = (daemon, plugin_name, None if previous is None else previous.index, current.index, generation)
+    diff = cache.get(key)
+    if diff is None:
+        diff = diff_result_records(previous, current)
+        cache.set(key, diff)
+    return diff
+
+def parse_timestamp(value, default):
+    """ Parse an ISO 8601 timestamp from a query parameter, returns None if it is invalid.
+    Timestamps with an offset, e.g. 'Z' or '+02:00', are converted to naive UTC like the stored timestamps.
+    """
+    if value is None:
+        return default
+
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return timestamp if timestamp.tzinfo is None else timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+def select_resolution(start, end):
+    """ Select the finest rollup resolution that covers the time range with at most 'ROLLUP_MAX_POINTS' buckets. """
+    max_points = current_app.config.get("ROLLUP_MAX_POINTS", 500)
+    for resolution, width in ResultRollup.RESOLUTIONS.items():
+        if (end - start) / width <= max_points:
+            return resolution
+    return resolution
+
+def parse_index(value):
+    """ Parse a run index from a query parameter, returns None if it is not an integer. """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@blueprint.route("/search", methods=["GET"])
+def search() -> JSON:
+    """ Search the scalar values of all results using the inverted index.
+    The 'q' query parameter matches every value with a word that starts with it, or that starts with it itself,
+    e.g. 'file2.html' matches '/srv/www/file2.html'. The results can be narrowed down by the 'daemon', 'plugin'
+    and 'key' query parameters and the amount of matches is bounded by 'limit'.
+    If 'q' is missing then 400 is returned.
+    If the request is successful then 200 is returned with the matches in JSON format.
+    """
+    query = request.args.get("q")
+    if not query:
+        return make_response("Bad Request", 400)
+
+    filters = {
+        column: request.args.get(parameter) for parameter, column in (("daemon", "daemon"), ("plugin", "plugin_name"), ("key", "key"))
+        if request.args.get(parameter) is not None
+    }
+    limit = max(min(parse_index(request.args.get("limit")) or current_app.config.get("RESULT_SEARCH_LIMIT", 100), current_app.config.get("RESULT_SEARCH_MAX_LIMIT", 1000)), 1)
+    term = query[:ResultIndex.TERM_LENGTH]
+    matches, seen, offset = [], set(), 0
+    try:
+        terms = retrieve_record(tablename="ResultIndex", **filters).filter(
+            ResultIndex.term >= term, ResultIndex.term < term + "\U0010ffff"
+        ).join(ResultValue, and_(
+            ResultValue.daemon == ResultIndex.daemon, ResultValue.plugin_name == ResultIndex.plugin_name,
+            ResultValue.index == ResultIndex.index, ResultValue.key == ResultIndex.key
+        )).with_entities(ResultValue).order_by(ResultIndex.term)
+        while len(matches) < limit:
+            records = terms.offset(offset).limit(limit).all()
+            for record in records:
+                match = (record.daemon, record.plugin_name, record.index, record.key)
+                if match not in seen and record.value.find(query) != -1 and len(matches) < limit:
+                    seen.add(match)
+                    matches.append(record.serialize)
+
+            if len(records) < limit:
+                break
+            offset += limit
+    except Exception as e:
+        current_app.logger.exception(f"'/result/search' - Failed to search the records for table: 'ResultIndex' with parameters: '{filters}'")
+        return make_response("Internal Server Error", 500)
+
+    return make_response(jsonify(matches), 200)
+
+@blueprint.route("/rollup", methods=["GET"])
+def rollup() -> JSON:
+    """ Get the amount of runs and runs with non-null results per time bucket from the rollups of the results.
+    The time range is given by the 'start' and 'end' query parameters in ISO 8601 and defaults to the last hour,
+    the resolution is selected from the range unless given by the 'resolution' query parameter ('1m', '1h' or '1d').
+    The buckets are grouped by 'daemon' or 'plugin' as given by the 'by' query parameter and can be narrowed down
+    by the 'daemon' and 'plugin' query parameters, if any of the parameters are invalid then 400 is returned.
+    If the request is successful then 200 is returned with the buckets in JSON format.
+    """
+    end = parse_timestamp(request.args.get("end"), datetime.utcnow())
+    start = parse_timestamp(request.args.get("start"), None if end is None else end - timedelta(hours=1))
+    resolution = request.args.get("resolution")
+    group = {"daemon": ResultRollup.daemon, "plugin": ResultRollup.plugin_name}.get(request.args.get("by", "daemon"))
+    if start is None or end is None or start > end or group is None or resolution not in (None, *ResultRollup.RESOLUTIONS):
+        return make_response("Bad Request", 400)
+
+    resolution = resolution or select_resolution(start, end)
+    filters = {
+        column: request.args.get(parameter) for parameter, column in (("daemon", "daemon"), ("plugin", "plugin_name"))
+        if request.args.get(parameter) is not None
+    }
+    try:
+        buckets = retrieve_record(tablename="ResultRollup", resolution=resolution, **filters).filter(
+            ResultRollup.bucket >= ResultRollup.truncate(start, resolution), ResultRollup.bucket <= end
+        ).with_entities(
+            ResultRollup.bucket, group, func.sum(ResultRollup.runs), func.sum(ResultRollup.non_null)
+        ).group_by(ResultRollup.bucket, group).order_by(ResultRollup.bucket, group).all()
+    except Exception as e:
+        current_app.logger.exception(f"'/result/rollup' - Failed to fetch the records for table: 'ResultRollup' with parameters: '{filters}'")
+        return make_response("Internal Server Error", 500)
+
+    return make_response(jsonify({
+        "resolution": resolution,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "buckets": [
+            {"bucket": bucket.isoformat(), request.args.get("by", "daemon"): name, "runs": runs, "non_null": non_null}
+            for bucket, name, runs, non_null in buckets
+        ]
+    }), 200)
+
 @blueprint.route("/<daemon>", methods=["GET"])
 @retrieve_results_record
 def results(daemon) -> JSON:
@@ -39,6 +207,87 @@ def results_plugin(daemon, plugin_name) -> JSON:
     """
     pass
 
+@blueprint.route("/<daemon>/<plugin_name>/latest", methods=["GET"])
+@retrieve_latest_results_record
+def results_plugin_latest(daemon, plugin_name) -> JSON:
+    """ Get the result with the highest run index for a specific plugin stored in the database relating to a given Trident daemon.
+    The result is read from the latest result projection using a single primary key lookup.
+    If the daemon and/or the plugin does not exist or has no results then the returned value is empty and 404 is returned.
+    If the request is successful then 200 is returned with the content in JSON format.
+    """
+    pass
+
+@blueprint.route("/<daemon>/<plugin_name>/diff", methods=["GET"])
+def results_plugin_diff(daemon, plugin_name) -> JSON:
+    """ Get the difference between the results at two run indexes for a specific plugin relating to a given Trident daemon.
+    The run indexes are given by the 'from' and 'to' query parameters, if either is missing or invalid then 400 is returned.
+    If the daemon, the plugin or either of the indexes does not exist then 404 is returned.
+    If the request is successful then 200 is returned with the difference in JSON format.
+    """
+    previous_index, current_index = parse_index(request.args.get("from")), parse_index(request.args.get("to"))
+    if previous_index is None or current_index is None:
+        return make_response("Bad Request", 400)
+
+    try:
+        generation = Generation.current(daemon)
+        previous = retrieve_record(tablename="Result", daemon=daemon, plugin_name=plugin_name, index=previous_index).first()
+        current = retrieve_record(tablename="Result", daemon=daemon, plugin_name=plugin_name, index=current_index).first()
+    except Exception as e:
+        current_app.logger.exception(f"'/result/<daemon>/<plugin_name>/diff' - Failed to fetch the records for table: 'Result'")
+        return make_response("Internal Server Error", 500)
+
+    if previous is None or current is None:
+        current_app.logger.error(f"'/result/<daemon>/<plugin_name>/diff' - No records for table: 'Result' at indexes: '{previous_index}', '{current_index}'")
+        return make_response("Not Found", 404)
+
+    return make_response(jsonify({
+        "daemon": daemon,
+        "plugin": plugin_name,
+        "from": previous_index,
+        "to": current_index,
+        "diff": diff_records(daemon, plugin_name, previous, current, generation)
+    }), 200)
+
+@blueprint.route("/<daemon>/<plugin_name>/changes", methods=["GET"])
+def results_plugin_changes(daemon, plugin_name) -> JSON:
+    """ Get the changes of the results after a given run index for a specific plugin relating to a given Trident daemon.
+    The run index is given by the 'since' query parameter, if it is missing or invalid then 400 is returned.
+    Each change is the difference between a result and the result at the previous run index,
+    the first change is relative to the latest result at or before 'since' or empty if there is none.
+    At most 'limit' changes are returned, the next changes are fetched with 'since' set to the returned 'latest'.
+    The differences of the changes are not memoized, so paging through the feed does not evict the memoized differences.
+    If the request is successful then 200 is returned with the changes and the latest run index in JSON format.
+    """
+    since = parse_index(request.args.get("since"))
+    if since is None:
+        return make_response("Bad Request", 400)
+
+    limit = max(min(parse_index(request.args.get("limit")) or current_app.config.get("RESULT_CHANGES_LIMIT", 100), current_app.config.get("RESULT_CHANGES_MAX_LIMIT", 1000)), 1)
+    try:
+        query = retrieve_record(tablename="Result", daemon=daemon, plugin_name=plugin_name)
+        previous = query.filter(Result.index <= since).order_by(Result.index.desc()).first()
+        records = query.filter(Result.index > since).order_by(Result.index).limit(limit).all()
+    except Exception as e:
+        current_app.logger.exception(f"'/result/<daemon>/<plugin_name>/changes' - Failed to fetch the records for table: 'Result'")
+        return make_response("Internal Server Error", 500)
+
+    changes = []
+    for record in records:
+        changes.append({
+            "index": record.index,
+            "previous": None if previous is None else previous.index,
+            "diff": diff_result_records(previous, record)
+        })
+        previous = record
+
+    return make_response(jsonify({
+        "daemon": daemon,
+        "plugin": plugin_name,
+        "since": since,
+        "latest": previous.index if previous is not None else None,
+        "changes": changes
+    }), 200)
+
 @blueprint.route("/<daemon>/<plugin_name>/<index>", methods=["GET"])
 @retrieve_results_record
 def results_plugin_index(daemon, plugin_name, index) -> JSON:
@@ -49,31 +298,42 @@ def results_plugin_index(daemon, plugin_name, index) -> JSON:
     pass
 
 @blueprint.route("/<daemon>/<plugin_name>/<index>", methods=["POST"])
+@limit_results_record
 def post_results_plugin_index(daemon, plugin_name, index) -> None:
     """ Post a new result for a specific plugin at a given run index stored in the database relating to a given Trident daemon.
     If the daemon and/or the plugin does not exist then 404 is returned.
     If the run index already exists then the results for that index will be overwritten.
+    The result is sent as JSON, MessagePack or CBOR given by the content type, otherwise 415 is returned.
+    If the result exceeds 'RESULT_MAX_SIZE' bytes then 413 is returned and if the run index is not an integer
+    or the result does not match the result schema then 400 is returned with the errors, before anything is stored.
     If the request is successful then 204 is returned.
     """
-    data = request.get_json()
-    if data is None or not retrieve_record(tablename="Daemon", daemon=daemon).first():
+    if parse_index(index) is None:
+        return make_response("Bad Request: index: expected an integer", 400)
+
+    data, response = read_payload("result", current_app.config.get("RESULT_MAX_SIZE", 16 * 1024 * 1024))
+    if response is not None:
+        return response
+
+    if not retrieve_record(tablename="Daemon", daemon=daemon).first():
         return make_response("Bad Request", 400)
 
     try:
         result_record = {
-            "index": index,
-            "result": data.get("result"),
+            "index": parse_index(index),
+            "result": data["result"],
             "plugin_name": plugin_name,
             "daemon": daemon
         }
         insert_record(tablename="Result", **result_record)
-    except Exception as e:
+    except SQLAlchemyError as e:
         current_app.logger.debug(f"'/result/<daemon>/<plugin_name>/<index>' - Failed to insert record to 'Result' with error: {e}")
         return make_response("Bad Request", 400)
 
     return make_response("", 201)
 
 @blueprint.route("/<daemon>", methods=["DELETE"])
+@limit_results_record
 @delete_results_record
 def delete_results(daemon) -> None:
     """ Delete all results for all plugins stored in the database relating to a given Trident daemon.
@@ -83,6 +343,7 @@ def delete_results(daemon) -> None:
     pass
 
 @blueprint.route("/<daemon>/<plugin_name>", methods=["DELETE"])
+@limit_results_record
 @delete_results_record
 def delete_results_plugin(daemon, plugin_name) -> None:
     """ Delete all results for a specific plugin stored in the database relating to a given Trident daemon.
@@ -92,6 +353,7 @@ def delete_results_plugin(daemon, plugin_name) -> None:
     pass
 
 @blueprint.route("/<daemon>/<plugin_name>/<index>", methods=["DELETE"])
+@limit_results_record
 @delete_results_record
 def delete_results_plugin_index(daemon, plugin_name, index) -> None:
     """ Delete all results for a specific plugin at a given run index stored in the database relating to a given Trident daemon.
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Trident: Schema Module.
+Handles the declarative schemas of the payloads sent by Trident daemons and their validation.
+
+The schemas of the daemon registration, the plugin configuration and the results are compiled once when the application
+is created into validators, closures that only do the checks of the schema, bounded by the limits in the configuration.
+A validator returns a list of errors given by the path of the invalid value, e.g. 'arguments.plugins.find-file.args'.
+
+@author: Jacob Wahlman
+"""
+
+from abc import ABC, abstractmethod
+from math import isfinite
+
+from trident.database.models import Daemon
+
+DAEMON_NAME_LENGTH = Daemon.__table__.c.daemon.type.length
+SCALAR_TYPES = (type(None), bool, int, float)
+KEY_TYPES = (str, int)
+
+
+def join_path(path, key):
+    """ Join the path of a value with the key of an item of the value. """
+    return f"{path}.{key}" if path else str(key)
+
+def type_name(value):
+    """ Return the name of the type of a value as used in the error reports. """
+    return "null" if value is None else type(value).__name__
+
+
+class Schema(ABC):
+    """ Base of the schemas, a schema is compiled into a check of a value that appends its errors to a list. """
+
+    def __init__(self, nullable=False):
+        self.nullable = nullable
+
+    def compile(self):
+        """ Compile the schema into a validator that returns the list of errors of a value. """
+        check = self.compile_check()
+        def validate(value):
+            errors = []
+            check(value, "", errors)
+            return errors
+        return validate
+
+    def compile_check(self):
+        """ Compile the schema into a check of a value that also accepts null if the schema is nullable. """
+        check = self.compile_value()
+        if not self.nullable:
+            return check
+
+        def check_nullable(value, path, errors):
+            if value is not None:
+                check(value, path, errors)
+        return check_nullable
+
+    @abstractmethod
+    def compile_value(self):
+        """ Compile the schema into a check of a non-null value. """
+
+
+class String(Schema):
+    """ A string of at most 'max_length' characters. """
+
+    def __init__(self, max_length=None, nullable=False):
+        super().__init__(nullable=nullable)
+        self.max_length = max_length
+
+    def compile_value(self):
+        max_length = self.max_length
+        def check(value, path, errors):
+            if type(value) is not str:
+                errors.append(f"{path}: expected a string, got {type_name(value)}")
+            elif max_length is not None and len(value) > max_length:
+                errors.append(f"{path}: exceeds {max_length} characters")
+        return check
+
+
+class Integer(Schema):
+    """ An integer between 'minimum' and 'maximum', booleans are not integers. """
+
+    def __init__(self, minimum=None, maximum=None, nullable=False):
+        super().__init__(nullable=nullable)
+        self.minimum, self.maximum = minimum, maximum
+
+    def compile_value(self):
+        minimum, maximum = self.minimum, self.maximum
+        def check(value, path, errors):
+            if type(value) is not int:
+                errors.append(f"{path}: expected an integer, got {type_name(value)}")
+            elif minimum is not None and value < minimum:
+                errors.append(f"{path}: must be at least {minimum}")
+            elif maximum is not None and value > maximum:
+                errors.append(f"{path}: must be at most {maximum}")
+        return check
+
+
+class Object(Schema):
+    """ An object with the given fields, the 'required' fields must be present and unknown fields are allowed if 'extra'. """
+
+    def __init__(self, fields, required=(), extra=True, nullable=False):
+        super().__init__(nullable=nullable)
+        self.fields, self.required, self.extra = fields, tuple(required), extra
+
+    def compile_value(self):
+        checks = tuple((name, field.compile_check()) for name, field in self.fields.items())
+        required, extra, names = self.required, self.extra, frozenset(self.fields)
+        def check(value, path, errors):
+            if type(value) is not dict:
+                errors.append(f"{path or 'payload'}: expected an object, got {type_name(value)}")
+                return
+
+            for name in required:
+                if name not in value:
+                    errors.append(f"{join_path(path, name)}: is required")
+            for name, field_check in checks:
+                if name in value:
+                    field_check(value[name], join_path(path, name), errors)
+            if not extra:
+                for name in value.keys() - names:
+                    errors.append(f"{join_path(path, name)}: is not allowed")
+        return check
+
+
+class Mapping(Schema):
+    """ An object of at most 'max_items' items where every key and value is of the given schemas. """
+
+    def __init__(self, keys, values, max_items=None, nullable=False):
+        super().__init__(nullable=nullable)
+        self.keys, self.values, self.max_items = keys, values, max_items
+
+    def compile_value(self):
+        check_key, check_item, max_items = self.keys.compile_check(), self.values.compile_check(), self.max_items
+        def check(value, path, errors):
+            if type(value) is not dict:
+                errors.append(f"{path}: expected an object, got {type_name(value)}")
+            elif max_items is not None and len(value) > max_items:
+                errors.append(f"{path}: exceeds {max_items} items")
+            else:
+                for key, item in value.items():
+                    item_path = join_path(path, key)
+                    check_key(key, item_path, errors)
+                    check_item(item, item_path, errors)
+        return check
+
+
+class Value(Schema):
+    """ Any value that can be stored as JSON, bounded by the nesting depth, the amount of values and the string lengths.
+    Object keys may be integers, which are stored as strings, since results sent in binary formats are keyed by index.
+    The value is checked without recursion and only its first error is reported, nested values may be null.
+    """
+
+    def __init__(self, max_depth=32, max_items=None, max_length=None, nullable=False):
+        super().__init__(nullable=nullable)
+        self.max_depth, self.max_items, self.max_length = max_depth, max_items, max_length
+
+    def compile_value(self):
+        max_depth, max_items, max_length = self.max_depth, self.max_items, self.max_length
+        def check(value, path, errors):
+            def error(node, message):
+                keys = []
+                while node is not None:
+                    node, key = node
+                    keys.append(key)
+
+                value_path = path
+                for key in reversed(keys):
+                    value_path = join_path(value_path, key)
+                errors.append(f"{value_path or 'payload'}: {message}")
+
+            if value is None:
+                return error(None, "expected a value, got null")
+
+            count, stack = 0, [(value, None, 0)]
+            while stack:
+                value, node, depth = stack.pop()
+                count += 1
+                if max_items is not None and count > max_items:
+                    return error(None, f"exceeds {max_items} values")
+
+                value_type = type(value)
+                if value_type is str:
+                    if max_length is not None and len(value) > max_length:
+                        return error(node, f"exceeds {max_length} characters")
+                elif value_type is float:
+                    if not isfinite(value):
+                        return error(node, f"expected a finite number, got {value}")
+                elif value_type in SCALAR_TYPES:
+                    continue
+                elif value_type is dict or value_type is list:
+                    if depth >= max_depth:
+                        return error(node, f"exceeds a depth of {max_depth}")
+                    for key, item in (value.items() if value_type is dict else enumerate(value)):
+                        if type(key) not in KEY_TYPES:
+                            return error(node, f"expected string keys, got {type_name(key)}")
+                        stack.append((item, (node, key), depth + 1))
+                else:
+                    return error(node, f"expected a JSON value, got {type_name(value)}")
+        return check
+
+
+class Switch(Schema):
+    """ An object of the 'present' schema if it has a non-null 'field', otherwise of the 'absent' schema. """
+
+    def __init__(self, field, present, absent, nullable=False):
+        super().__init__(nullable=nullable)
+        self.field, self.present, self.absent = field, present, absent
+
+    def compile_value(self):
+        field, check_present, check_absent = self.field, self.present.compile_check(), self.absent.compile_check()
+        def check(value, path, errors):
+            if type(value) is dict and value.get(field) is not None:
+                check_present(value, path, errors)
+            else:
+                check_absent(value, path, errors)
+        return check
+
+
+def plugin_schema(config):
+    """ The schema of the configuration of a plugin sent when a daemon connects. """
+    return Object({
+        "path": String(max_length=config.get("PLUGIN_MAX_PATH_LENGTH", 255), nullable=True),
+        "plugin_args": Value(max_items=config.get("PLUGIN_MAX_ARGUMENTS", 10000), nullable=True),
+        "args": Value(max_items=config.get("PLUGIN_MAX_ARGUMENTS", 10000), nullable=True)
+    })
+
+def daemon_schema(config):
+    """ The schema of the registration sent when a daemon connects, the daemon name is only sent when reconnecting.
+    A new daemon must send its address and worker count while a reconnecting daemon may send only its name.
+    The daemon name is bounded by the length of the column, which also bounds the generated names.
+    """
+    def registration(required):
+        return Object({
+            "daemon": String(max_length=DAEMON_NAME_LENGTH, nullable=True),
+            "host_addr": String(max_length=15),
+            "worker_count": Integer(minimum=0),
+            "arguments": Object({
+                "logging_level": String(max_length=20, nullable=True),
+                "args": Value(max_items=config.get("PLUGIN_MAX_ARGUMENTS", 10000), nullable=True),
+                "plugins": Mapping(String(max_length=20), plugin_schema(config), max_items=config.get("DAEMON_MAX_PLUGINS", 256))
+            })
+        }, required=required)
+
+    return Switch("daemon", registration(()), registration(("host_addr", "worker_count")))
+
+def result_schema(config):
+    """ The schema of a result sent by a plugin of a daemon. """
+    return Object({
+        "result": Value(
+            max_depth=config.get("RESULT_MAX_DEPTH", 32),
+            max_items=config.get("RESULT_MAX_VALUES", 1000000),
+            max_length=config.get("RESULT_MAX_STRING_LENGTH", 65536)
+        )
+    }, required=("result",))
+
+SCHEMAS = {"daemon": daemon_schema, "plugin": plugin_schema, "result": result_schema}
+
+
+def init_schemas(app):
+    """ Compile the payload schemas of the application once, bounded by the limits in its configuration. """
+    app.extensions["trident_schemas"] = {name: schema(app.config).compile() for name, schema in SCHEMAS.items()}
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Trident: Snapshot Module.
+Handles the export and import of the daemons, plugins and results of the dashboard.
+
+Snapshots are streamed as NDJSON where every line is a record of a table, optionally as a gzip compressed archive.
+Exports read the records in batches using server-side cursors and imports insert the records in batched transactions,
+so the memory used is bounded by the batch size and not by the size of the snapshot. Since every batch is committed
+on its own, a failed import keeps the batches before the failing one, records that already exist are skipped so the
+same snapshot can be sent again to resume the import.
+
+@author: Jacob Wahlman
+"""
+
+import json
+import zlib
+from os import close, unlink
+from tempfile import mkstemp
+from datetime import datetime
+from typing import AnyStr, NewType
+JSON = NewType("JSON", None)
+
+from flask import Blueprint, Response, request, current_app, make_response, stream_with_context
+from sqlalchemy import tuple_
+from sqlalchemy.exc import SQLAlchemyError
+
+from trident.backend.columnar import FORMATS, available, result_query, result_columns, result_batches, write_csv, write_arrow, write_parquet
+from trident.database.models import database, Daemon, Plugin, Result
+
+blueprint = Blueprint("snapshot", __name__, url_prefix="/snapshot")
+
+TABLES = {"Daemon": Daemon, "Plugin": Plugin, "Result": Result}
+IMPORT_EXCLUDED_COLUMNS = {"Plugin": {"plugin"}}
+IMPORT_KEYS = {"Daemon": ("daemon",), "Plugin": ("daemon", "plugin_name"), "Result": ("index", "plugin_name")}
+CHUNK_SIZE = 64 * 1024
+
+
+def export_record(record) -> JSON:
+    """ Return the column values of a record, timestamps are formatted in ISO 8601. """
+    values = {}
+    for column in record.__table__.columns:
+        value = getattr(record, column.key)
+        values[column.key] = value.isoformat() if isinstance(value, datetime) else value
+    return values
+
+def import_record(tablename, values):
+    """ Create a record of the table from exported column values, columns that are generated on insert are skipped. """
+    table = TABLES[tablename]
+    excluded = IMPORT_EXCLUDED_COLUMNS.get(tablename, set())
+    record = {}
+    for column in table.__table__.columns:
+        if column.key in excluded or column.key not in values:
+            continue
+
+        value = values[column.key]
+        if isinstance(column.type, database.DateTime) and value is not None:
+            value = datetime.fromisoformat(value)
+        record[column.key] = value
+    return table(**record)
+
+def import_batch(batch):
+    """ Insert and commit a batch of imported records, records whose key in 'IMPORT_KEYS' already exists are skipped.
+    Returns the amount of inserted records per table.
+    """
+    imported = {tablename: 0 for tablename in TABLES}
+    for tablename, table in TABLES.items():
+        records = [record for name, record in batch if name == tablename]
+        if not records:
+            continue
+
+        columns = [getattr(table, key) for key in IMPORT_KEYS[tablename]]
+        keys = [tuple(getattr(record, key) for key in IMPORT_KEYS[tablename]) for record in records]
+        existing = set(database.session.query(*columns).filter(tuple_(*columns).in_(set(keys))).all())
+        for key, record in zip(keys, records):
+            if key not in existing:
+                existing.add(key)
+                database.session.add(record)
+                imported[tablename] += 1
+
+    database.session.commit()
+    return imported
+
+def export_lines(daemon=None):
+    """ Yield every record of the daemon, or of all daemons, as NDJSON lines using batched server-side cursors. """
+    batch_size = current_app.config.get("SNAPSHOT_BATCH_SIZE", 1000)
+    for tablename, table in TABLES.items():
+        query = table.query if daemon is None else table.query.filter_by(daemon=daemon)
+        for record in query.execution_options(stream_results=True).yield_per(batch_size):
+            yield json.dumps({"table": tablename, "record": export_record(record)}) + "\n"
+
+def export_chunks(lines, compress=False):
+    """ Join the lines into chunks of about 'CHUNK_SIZE' bytes, compressing them as a gzip stream if requested. """
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    chunk, size = [], 0
+    for line in lines:
+        chunk.append(line.encode())
+        size += len(chunk[-1])
+        if size >= CHUNK_SIZE:
+            data = b"".join(chunk)
+            chunk, size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+
+    data = b"".join(chunk)
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+class LineTooLarge(ValueError):
+    """ Raised when a line of an imported snapshot exceeds the maximum line size. """
+
+
+def read_chunks(stream, compressed=False):
+    """ Yield the chunks of a request body while it is read, decompressed into chunks of at most 'CHUNK_SIZE' bytes
+    if it is gzip compressed, so the decompressed data is never held whole however well it compresses.
+    """
+    decompressor = zlib.decompressobj(wbits=31) if compressed else None
+    while True:
+        data = stream.read(CHUNK_SIZE)
+        if not data:
+            break
+
+        if decompressor is None:
+            yield data
+            continue
+
+        while data:
+            yield decompressor.decompress(data, CHUNK_SIZE)
+            data = decompressor.unconsumed_tail
+
+    if decompressor:
+        yield decompressor.flush()
+
+def import_lines(stream, compressed=False, max_line_size=None):
+    """ Yield the NDJSON lines of a request body while it is read, decompressing it if it is gzip compressed.
+    The buffer is only searched for a newline in the data read since the last search,
+    a line longer than 'max_line_size' bytes raises 'LineTooLarge' before it is read whole.
+    """
+    buffer, searched = bytearray(), 0
+    for data in read_chunks(stream, compressed=compressed):
+        buffer += data
+        start, end = 0, buffer.find(b"\n", searched)
+        while end != -1:
+            if buffer[start:end].strip():
+                yield bytes(buffer[start:end])
+            start, end = end + 1, buffer.find(b"\n", end + 1)
+
+        del buffer[:start]
+        searched = len(buffer)
+        if max_line_size is not None and len(buffer) > max_line_size:
+            raise LineTooLarge(f"The line exceeds {max_line_size} bytes")
+
+    if buffer.strip():
+        yield bytes(buffer)
+
+def export_response(daemon=None):
+    """ Return a streamed snapshot response in the format given by the 'format' query parameter. """
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in ("ndjson", "gzip"):
+        return make_response("Bad Request", 400)
+
+    compress = export_format == "gzip"
+    filename = "trident-{}.ndjson{}".format(daemon or "fleet", ".gz" if compress else "")
+    return Response(
+        stream_with_context(export_chunks(export_lines(daemon), compress=compress)),
+        mimetype="application/gzip" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+
+@blueprint.route("", methods=["GET"])
+def export_fleet() -> JSON:
+    """ Export the daemons, plugins and results of all Trident daemons as a streamed snapshot.
+    The 'format' query parameter selects 'ndjson' (default) or a 'gzip' compressed archive, otherwise 400 is returned.
+    If the request is successful then 200 is returned with the snapshot streamed as the content.
+    """
+    return export_response()
+
+@blueprint.route("/columnar", methods=["GET"])
+def export_columnar() -> JSON:
+    """ Export the results flattened into typed columns, one row per result and one column per scalar in the results.
+    The 'format' query parameter selects 'csv' (default), an 'arrow' IPC stream or 'parquet', otherwise 400 is returned,
+    and the results can be narrowed down by the 'daemon' and 'plugin' query parameters.
+    If the format requires 'pyarrow' and it is not installed then 501 is returned.
+    If the request is successful then 200 is returned with the results streamed as the content.
+    """
+    export_format = request.args.get("format", "csv")
+    if export_format not in FORMATS:
+        return make_response("Bad Request", 400)
+
+    if not available(export_format):
+        return make_response("Not Implemented", 501)
+
+    batch_size = current_app.config.get("COLUMNAR_BATCH_SIZE", 10000)
+    query = result_query(request.args.get("daemon"), request.args.get("plugin"))
+    columns = result_columns(query, batch_size)
+    batches = result_batches(query, columns, batch_size)
+    if export_format == "csv":
+        return Response(stream_with_context(write_csv(batches, columns)), mimetype="text/csv")
+    if export_format == "arrow":
+        return Response(stream_with_context(write_arrow(batches, columns)), mimetype="application/vnd.apache.arrow.stream")
+
+    descriptor, path = mkstemp(suffix=".parquet")
+    close(descriptor)
+    try:
+        write_parquet(batches, columns, path)
+    except Exception as e:
+        unlink(path)
+        raise e
+
+    def stream_file():
+        with open(path, "rb") as parquet:
+            for chunk in iter(lambda: parquet.read(CHUNK_SIZE), b""):
+                yield chunk
+
+    response = Response(stream_file(), mimetype="application/vnd.apache.parquet")
+    response.call_on_close(lambda: unlink(path))
+    return response
+
+@blueprint.route("/<daemon>", methods=["GET"])
+def export_daemon(daemon) -> JSON:
+    """ Export the daemon, plugins and results of a given Trident daemon as a streamed snapshot.
+    If the daemon does not exist then 404 is returned.
+    If the request is successful then 200 is returned with the snapshot streamed as the content.
+    """
+    if not Daemon.query.filter_by(daemon=daemon).first():
+        return make_response("Not Found", 404)
+
+    return export_response(daemon)
+
+@blueprint.route("", methods=["POST"])
+def import_snapshot() -> JSON:
+    """ Import a snapshot of daemons, plugins and results, the records are inserted in batches of 'SNAPSHOT_BATCH_SIZE'.
+    The snapshot is read as gzip if the request has the 'gzip' content encoding or the 'application/gzip' content type,
+    and a line may be at most 'SNAPSHOT_MAX_LINE_SIZE' bytes, otherwise its line is rejected like an invalid record.
+    Records that already exist are skipped, so a snapshot can be sent again to resume an import that failed.
+    If a record is invalid then its batch is rolled back and 400 is returned with the line of the failing record,
+    or the lines of the failing batch, and the amount of records per table imported by the batches committed before it.
+    If the request is successful then 201 is returned with the amount of imported records per table.
+    """
+    batch_size = current_app.config.get("SNAPSHOT_BATCH_SIZE", 1000)
+    max_line_size = current_app.config.get("SNAPSHOT_MAX_LINE_SIZE", 32 * 1024 * 1024)
+    compressed = request.content_encoding == "gzip" or request.mimetype == "application/gzip"
+    imported = {tablename: 0 for tablename in TABLES}
+    batch, first, number = [], 1, 0
+
+    def reject(lines):
+        database.session.rollback()
+        current_app.logger.exception(f"'/snapshot' - Failed to import the snapshot at {lines} after: '{imported}'")
+        return make_response(f"Bad Request: {lines}: failed to import, imported: {json.dumps(imported)}", 400)
+
+    try:
+        for number, line in enumerate(import_lines(request.stream, compressed=compressed, max_line_size=max_line_size), start=1):
+            entry = json.loads(line)
+            batch.append((entry["table"], import_record(entry["table"], entry["record"])))
+            if len(batch) >= batch_size:
+                for tablename, count in import_batch(batch).items():
+                    imported[tablename] += count
+                batch, first = [], number + 1
+
+        for tablename, count in import_batch(batch).items():
+            imported[tablename] += count
+    except SQLAlchemyError as e:
+        return reject(f"lines {first}-{number}")
+    except (LineTooLarge, zlib.error) as e:
+        return reject(f"line {number + 1}")
+    except (ValueError, KeyError, TypeError) as e:
+        return reject(f"line {number}")
+
+    return make_response(imported, 201)
@@ -13,9 +13,17 @@ from functools import partial
 from typing import AnyStr, NewType
 JSON = NewType("JSON", None)
 
-from flask import Blueprint, request, current_app, make_response 
+from flask import Blueprint, request, current_app, make_response, jsonify
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import aliased, joinedload
 
 from trident import ROOT_DIR
+from trident.backend.cache import get_cache
+from trident.backend.limit import limit_decorator
+from trident.backend.payload import read_payload
+from trident.backend.schema import DAEMON_NAME_LENGTH
+from trident.database.models import Daemon, Plugin, Result, Generation
 from trident.database.handler import retrieve_decorator, insert_decorator, delete_decorator, insert_record, retrieve_record
 
 retrieve_trident_record = partial(retrieve_decorator, tablename="Daemon")
@@ -23,23 +31,55 @@ retrieve_connected_trident_record = partial(retrieve_decorator, tablename="Conne
 insert_trident_record = partial(insert_decorator, tablename="Daemon")
 delete_trident_record = partial(delete_decorator, tablename="Daemon")
 delete_connected_trident_record = partial(delete_decorator, tablename="ConnectedDaemon")
+limit_trident_record = partial(limit_decorator, scope="trident")
 blueprint = Blueprint("trident", __name__, url_prefix="/trident")
 
 
+def overview_cache():
+    """ Get the cache of composed daemon overviews keyed by '(daemon, latest, generation)'. """
+    return get_cache("daemon_overview", maxsize=current_app.config.get("OVERVIEW_CACHE_SIZE", 256), daemon=True)
+
+def compose_overview(daemon, latest) -> JSON:
+    """ Compose the overview of a daemon with its plugins and the latest results of every plugin.
+    The daemon and its plugins are loaded with one joined query and the results with one windowed query.
+    If the daemon does not exist then None is returned.
+    """
+    record = Daemon.query.options(joinedload(Daemon.daemon_plugin_rel)).filter_by(daemon=daemon).first()
+    if record is None:
+        return None
+
+    rank = func.row_number().over(partition_by=Result.plugin_name, order_by=Result.index.desc()).label("rank")
+    ranked = Result.query.with_entities(Result, rank).filter_by(daemon=daemon).subquery()
+    latest_result = aliased(Result, ranked)
+    results = {plugin.plugin_name: [] for plugin in record.daemon_plugin_rel}
+    for result in Result.query.with_entities(latest_result).filter(ranked.c.rank <= latest).order_by(ranked.c.plugin_name, ranked.c.index.desc()):
+        results.setdefault(result.plugin_name, []).append(result.serialize)
+
+    return {
+        "daemon": record.serialize,
+        "plugins": [plugin.serialize for plugin in record.daemon_plugin_rel],
+        "results": results
+    }
+
+
 @blueprint.route("/connect", methods=["POST"])
+@limit_trident_record
 def connect() -> JSON:
     """ Connect an Trident daemon to the dashboard.
     The endpoint accepts information regarding the daemon like, amount of workers,
     information about all plugins in the daemon and more.
     The endpoint returns the unique identification on the dashboard.
+    The information is sent as JSON, MessagePack or CBOR given by the content type, otherwise 415 is returned.
+    If the information exceeds 'DAEMON_MAX_SIZE' bytes then 413 is returned and if it does not match the daemon schema
+    then 400 is returned with the errors, before anything is stored.
     """
-    data = request.get_json()
-    if data is None:
-        return make_response("Bad Request", 400)
+    data, response = read_payload("daemon", current_app.config.get("DAEMON_MAX_SIZE", 1024 * 1024))
+    if response is not None:
+        return response
 
     def generate_daemon_name():
         daemon_name = None
-        while daemon_name is None or retrieve_record(tablename="Daemon", daemon=daemon_name).first():
+        while daemon_name is None or len(daemon_name) > DAEMON_NAME_LENGTH or retrieve_record(tablename="Daemon", daemon=daemon_name).first():
             with open(path.join(ROOT_DIR, "data", "english-adjectives.txt"), "r") as adjectives:
                 with open(path.join(ROOT_DIR, "data", "animals.txt"), "r") as animals:
                     daemon_name = "{}-{}".format(choice(adjectives.readlines()).strip(), choice(animals.readlines()).strip())
@@ -60,7 +100,7 @@ def connect() -> JSON:
                 }
             }
             insert_record(tablename="Daemon", **daemon_record)
-        except Exception as e:
+        except SQLAlchemyError as e:
             current_app.logger.debug(f"'/connect' - Failed to insert record to 'Daemon' with error: {e}")
             return make_response("Bad Request", 400)
 
@@ -73,7 +113,7 @@ def connect() -> JSON:
                     "daemon": daemon_name
                 }
                 insert_record(tablename="Plugin", **plugin_record)
-        except Exception as e:
+        except SQLAlchemyError as e:
             current_app.logger.debug(f"'/trident/connect' - Failed to insert record to 'Plugin' with error: {e}")
             return make_response("Bad Request", 400)
 
@@ -85,13 +125,14 @@ def connect() -> JSON:
             "daemon": daemon_name
         }
         insert_record(tablename="ConnectedDaemon", daemon=daemon_name)
-    except Exception as e:
+    except SQLAlchemyError as e:
         current_app.logger.debug(f"'/connect' - Failed to insert record to 'ConnectedDaemon' with error: {e}")
         return make_response("Bad Request", 400)
 
     return make_response({"daemon": daemon_name}, 201)
 
 @blueprint.route("/disconnect/<daemon>", methods=["DELETE"])
+@limit_trident_record
 @delete_connected_trident_record
 def disconnect(daemon) -> None:
     """ Disconnect a Trident daemon from the dashboard.
@@ -107,6 +148,7 @@ def connected() -> JSON:
     pass
 
 @blueprint.route("/remove/<daemon>", methods=["DELETE"])
+@limit_trident_record
 @delete_trident_record
 @delete_connected_trident_record
 def remove(daemon) -> None:
@@ -123,3 +165,42 @@ def daemon(daemon) -> JSON:
     the information includes arguments provided to the daemon, name of plugins and more.
     """
     pass
+
+@blueprint.route("/<daemon>/overview", methods=["GET"])
+def overview(daemon) -> JSON:
+    """ Get an overview of the Trident daemon with its information, plugins and the latest results of every plugin.
+    The amount of results per plugin is given by the 'latest' query parameter, if it is invalid then 400 is returned.
+    If the daemon does not exist then 404 is returned.
+    If the request is successful then 200 is returned with the content in JSON format.
+    """
+    try:
+        latest = int(request.args.get("latest", current_app.config.get("OVERVIEW_LATEST_RESULTS", 5)))
+    except ValueError:
+        return make_response("Bad Request", 400)
+
+    if not 0 < latest <= current_app.config.get("OVERVIEW_MAX_LATEST_RESULTS", 100):
+        return make_response("Bad Request", 400)
+
+    cache = overview_cache()
+    try:
+        generation = Generation.current(daemon)
+    except SQLAlchemyError as e:
+        current_app.logger.exception(f"'/trident/<daemon>/overview' - Failed to fetch the generation of daemon: '{daemon}'")
+        return make_response("Internal Server Error", 500)
+
+    content = cache.get((daemon, latest, generation))
+    if content is None:
+        try:
+            document = compose_overview(daemon, latest)
+        except Exception as e:
+            current_app.logger.exception(f"'/trident/<daemon>/overview' - Failed to compose the overview for daemon: '{daemon}'")
+            return make_response("Internal Server Error", 500)
+
+        if document is None:
+            current_app.logger.error(f"'/trident/<daemon>/overview' - No records for table: 'Daemon' with daemon: '{daemon}'")
+            return make_response("Not Found", 404)
+
+        content = jsonify(document).get_data()
+        cache.set((daemon, latest, generation), content)
+
+    return make_response(content, 200, {"Content-Type": "application/json"})
@@ -7,14 +7,99 @@ Handles all logic and interaction with the database.
 @author: Jacob Wahlman
 """
 
+from os import register_at_fork
+from threading import Event, Lock
+from weakref import WeakSet
 from functools import wraps
 from inspect import signature
 
 from flask import make_response, jsonify, current_app
-from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
 
 from trident.database.models import *
 
+MEMORY_DATABASE_URIS = ("sqlite://", "sqlite:///:memory:")
+_engines = WeakSet()
+
+
+def _dispose_engines():
+    """ Dispose the connection pools inherited from the parent process without closing the parent's connections. """
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+register_at_fork(after_in_child=_dispose_engines)
+
+def configure_engine(app):
+    """ Make the database engine of the application safe to use in forked worker processes.
+    After a fork the child disposes of the inherited connection pool and creates its own on first use.
+    In-memory databases only exist within their connection and are therefore left untouched.
+    """
+    if app.config["SQLALCHEMY_DATABASE_URI"] in MEMORY_DATABASE_URIS:
+        return
+
+    with app.app_context():
+        _engines.add(database.engine)
+
+class SingleFlight:
+    """ Shares the result of a call between all concurrent callers with the same key.
+    The first caller of a key executes the call while later callers wait for and share its result,
+    once the call has finished the next caller of the key executes it again. A call that started before a write can
+    still finish after it, so the key must include what the result depends on, e.g. the generation of the daemon.
+    """
+
+    class Call:
+        __slots__ = ("event", "result", "error")
+
+        def __init__(self):
+            self.event = Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = Lock()
+
+    def do(self, key, func):
+        """ Call the function, or wait for the in-flight call with the same key, and return its result. """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = SingleFlight.Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise e
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+def get_single_flight(app=None):
+    """ Get the single flight of the application used to coalesce identical concurrent reads, created on first use. """
+    app = app or current_app
+    single_flight = app.extensions.get("trident_single_flight")
+    if single_flight is None:
+        single_flight = app.extensions["trident_single_flight"] = SingleFlight()
+    return single_flight
+
+def create_schema():
+    """ Create all tables of the database models that do not already exist in the database. """
+    try:
+        database.create_all()
+    except Exception as e:
+        current_app.logger.exception("Failed to create the database schema")
+        raise e
 
 def retrieve_record(tablename, **kwargs):
     """ Given a tablename query the table given the kwargs provided into that table. """
@@ -58,31 +143,53 @@ def delete_record(tablename, **kwargs):
         current_app.logger.exception(f"Failed to delete record from database table: '{tablename}'")
         raise e
     
+def retrieve_content(tablename, kwargs):
+    """ Query the table given the kwargs and return the status code and content of the response. """
+    try:
+        records = retrieve_record(tablename=tablename, **kwargs).all()
+    except Exception as e:
+        current_app.logger.exception(f"Failed to fetch the records for table: '{tablename}' with parameters: '{kwargs}'")
+        return 500, "Internal Server Error"
+
+    if not records:
+        current_app.logger.error(f"No records for table: '{tablename}' with parameters: '{kwargs}'")
+        return 404, "Not Found"
+
+    try:
+        f_records = jsonify([record.serialize for record in records]).get_data()
+    except Exception as e:
+        current_app.logger.exception(f"Failed to format the records for table: '{tablename}' with parameters: '{kwargs}' as JSON")
+        return 500, "Internal Server Error"
+
+    return 200, f_records
+
 def retrieve_decorator(func, tablename):
     """ Used by 'GET' endpoints to retrieve records from the backend database tables.
+    Concurrent identical requests of a daemon are coalesced, only one of them queries the table and the serialized
+    records are shared. Requests only share a query started at the current generation of the daemon, so a request
+    never gets records from before a write that was committed before it arrived.
     If any errors occur then the decorator will return '500'
     If the query did not result in any records then the decorator will return '404'
     If the query is successful then the decorator will return '200' 
     """
     @wraps(func)
     def decorator(*args, **kwargs):
-        try:
-            records = retrieve_record(tablename=tablename, **kwargs).all()
-        except Exception as e:
-            current_app.logger.exception(f"Failed to fetch the records for table: '{tablename}' with parameters: '{kwargs}'")
-            return make_response("Internal Server Error", 500)
-
-        if not records:
-            current_app.logger.error(f"No records for table: '{tablename}' with parameters: '{kwargs}'")
-            return make_response("Not Found", 404)
-
-        try:
-            f_records = jsonify([record.serialize for record in records])
-        except Exception as e:
-            current_app.logger.exception(f"Failed to format the records for table: '{tablename}' with parameters: '{kwargs}' as JSON")
-            return make_response("Internal Server Error", 500)
-
-        return make_response(f_records, 200)
+        if "daemon" in kwargs:
+            try:
+                generation = Generation.current(kwargs["daemon"])
+            except SQLAlchemyError as e:
+                current_app.logger.exception(f"Failed to fetch the generation of the daemon: '{kwargs['daemon']}'")
+                return make_response("Internal Server Error", 500)
+
+            key = (tablename, tuple(sorted(kwargs.items())), generation)
+            status, content = get_single_flight().do(key, lambda: retrieve_content(tablename, kwargs))
+        else:
+            status, content = retrieve_content(tablename, kwargs)
+
+        if status != 200:
+            return make_response(content, status)
+
+        return current_app.response_class(content, status=200, mimetype="application/json")
 
     return decorator
 
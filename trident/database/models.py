@@ -7,7 +7,13 @@ Database models for Trident dashboard.
 @author: Jacob Wahlman
 """
 
+import re
+from json import dumps
+from datetime import datetime, timedelta
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, bindparam
+from sqlalchemy.orm import Session
 
 database = SQLAlchemy()
 
@@ -101,11 +107,15 @@ class Plugin(database.Model):
 class Result(database.Model):
     """ Database model for Trident Results. """
     __tablename__ = "result"
+    __table_args__ = (
+        database.Index("ix_result_daemon_plugin_index", "daemon", "plugin_name", "index"),
+    )
 
     index = database.Column(database.Integer, primary_key=True)
     plugin_name = database.Column(database.String(20), database.ForeignKey("plugin.plugin_name"), primary_key=True)
     result = database.Column(database.JSON, nullable=False)
     daemon = database.Column(database.String(20), database.ForeignKey("daemon.daemon"), nullable=False)
+    timestamp = database.Column(database.DateTime, nullable=False, default=datetime.utcnow)
 
     def __repr__(self):
         return f"({self.index}) {self.plugin_name}@{self.daemon}"
@@ -121,7 +131,8 @@ class Result(database.Model):
                 "index": self.index,
                 "result": self.result,
                 "plugin": self.plugin_name,
-                "daemon": self.daemon
+                "daemon": self.daemon,
+                "timestamp": self.timestamp.isoformat() if self.timestamp is not None else None
             }
         except Exception as e:
             raise ValueError(f"Failed to serialize 'Plugin' model instance.")
@@ -129,3 +140,316 @@ class Result(database.Model):
     def insert_result(self, index, value):
         """ Insert a value in the result dictionary. """
         self.result[index] = value
+
+
+class LatestResult(database.Model):
+    """ Database model for the latest result of every plugin of Trident Daemons.
+    The table is a projection of the result with the highest run index per daemon and plugin,
+    it is maintained within the same transaction as the results.
+    """
+    __tablename__ = "latest_result"
+
+    daemon = database.Column(database.String(20), primary_key=True)
+    plugin_name = database.Column(database.String(20), primary_key=True)
+    index = database.Column(database.Integer, nullable=False)
+    result = database.Column(database.JSON, nullable=False)
+
+    def __repr__(self):
+        return f"({self.index}) {self.plugin_name}@{self.daemon}"
+
+    @property
+    def serialize(self):
+        """ Return a serialized LatestResult instance.
+        If it is not serializable then a ValueError is raised.
+        If it is serializable then the returned value is a dictionary.
+        """
+        try:
+            return {
+                "index": self.index,
+                "result": self.result,
+                "plugin": self.plugin_name,
+                "daemon": self.daemon
+            }
+        except Exception as e:
+            raise ValueError(f"Failed to serialize 'LatestResult' model instance.")
+
+
+class ResultRollup(database.Model):
+    """ Database model for the time-series rollups of the outcomes of Trident Results.
+    Every bucket counts the runs and the runs with a non-null result of a plugin of a daemon
+    that started within the bucket, the buckets are maintained when results are inserted.
+    """
+    __tablename__ = "result_rollup"
+
+    RESOLUTIONS = {
+        "1m": timedelta(minutes=1),
+        "1h": timedelta(hours=1),
+        "1d": timedelta(days=1)
+    }
+
+    resolution = database.Column(database.String(2), primary_key=True)
+    daemon = database.Column(database.String(20), primary_key=True)
+    plugin_name = database.Column(database.String(20), primary_key=True)
+    bucket = database.Column(database.DateTime, primary_key=True)
+    runs = database.Column(database.Integer, nullable=False, default=0)
+    non_null = database.Column(database.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"[{self.resolution} {self.bucket}] {self.plugin_name}@{self.daemon}"
+
+    @staticmethod
+    def truncate(timestamp, resolution):
+        """ Truncate a timestamp to the start of its bucket at the given resolution. """
+        if resolution == "1m":
+            return timestamp.replace(second=0, microsecond=0)
+        if resolution == "1h":
+            return timestamp.replace(minute=0, second=0, microsecond=0)
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class ResultValue(database.Model):
+    """ Database model for the scalar values of Trident Results, stored once per key of a result for the inverted index. """
+    __tablename__ = "result_value"
+
+    daemon = database.Column(database.String(20), primary_key=True)
+    plugin_name = database.Column(database.String(20), primary_key=True)
+    index = database.Column(database.Integer, primary_key=True)
+    key = database.Column(database.Text, primary_key=True)
+    value = database.Column(database.Text, nullable=False)
+
+    def __repr__(self):
+        return f"{self.key}={self.value} ({self.index}) {self.plugin_name}@{self.daemon}"
+
+    @property
+    def serialize(self):
+        """ Return a serialized ResultValue instance.
+        If it is not serializable then a ValueError is raised.
+        If it is serializable then the returned value is a dictionary.
+        """
+        try:
+            return {
+                "index": self.index,
+                "key": self.key,
+                "value": self.value,
+                "plugin": self.plugin_name,
+                "daemon": self.daemon
+            }
+        except Exception as e:
+            raise ValueError(f"Failed to serialize 'ResultValue' model instance.")
+
+
+class ResultIndex(database.Model):
+    """ Database model for the inverted index over the scalar values of Trident Results.
+    Each entry maps a term of a scalar value in a result to the key it was found at and the result it belongs to,
+    the value itself is stored once in 'ResultValue' so the entries stay small however long the value is.
+    The terms of a value are its suffixes starting at every word, e.g. '/srv/www/file2.html' is found by searching for
+    '/srv', 'www/file' or 'file2.html', so a prefix search of the terms matches words anywhere in the value.
+    """
+    __tablename__ = "result_index"
+    __table_args__ = (
+        database.Index("ix_result_index_term", "term", "daemon", "plugin_name"),
+        database.Index("ix_result_index_daemon_term", "daemon", "term", "plugin_name"),
+        database.Index("ix_result_index_result", "daemon", "plugin_name", "index")
+    )
+    TERM_LENGTH = 128
+    MAX_TERMS = 32
+    WORD = re.compile(r"\w+")
+
+    entry = database.Column(database.Integer, primary_key=True)
+    term = database.Column(database.Text, nullable=False)
+    key = database.Column(database.Text, nullable=False)
+    index = database.Column(database.Integer, nullable=False)
+    plugin_name = database.Column(database.String(20), nullable=False)
+    daemon = database.Column(database.String(20), nullable=False)
+
+    def __repr__(self):
+        return f"{self.term}@{self.key} ({self.index}) {self.plugin_name}@{self.daemon}"
+
+    @staticmethod
+    def entries(value, key=None):
+        """ Yield the key and text of every non-null scalar in a result, keys of nested values are joined by '.'.
+        Keys are not necessarily unique, e.g. '{"a.b": 1, "a": {"b": 2}}', see 'values'.
+        """
+        if isinstance(value, dict):
+            items = value.items()
+        elif isinstance(value, list):
+            items = enumerate(value)
+        else:
+            if value is not None:
+                yield key or "", value if isinstance(value, str) else dumps(value)
+            return
+
+        for item_key, item_value in items:
+            yield from ResultIndex.entries(item_value, str(item_key) if key is None else f"{key}.{item_key}")
+
+    @staticmethod
+    def values(result):
+        """ Return the text of every non-null scalar in a result by its key, the first value of a repeated key is kept. """
+        values = {}
+        for key, value in ResultIndex.entries(result):
+            values.setdefault(key, value)
+        return values
+
+    @staticmethod
+    def terms(text):
+        """ Return the distinct terms of a text, its suffixes at the start of the text and of every word.
+        Terms are truncated to 'TERM_LENGTH' characters and at most 'MAX_TERMS' terms are returned.
+        """
+        starts = [0] + [word.start() for word in ResultIndex.WORD.finditer(text)]
+        terms = dict.fromkeys(text[start:start + ResultIndex.TERM_LENGTH] for start in starts)
+        return list(terms)[:ResultIndex.MAX_TERMS]
+
+
+class Generation(database.Model):
+    """ Database model for the write generation of Trident Daemons.
+    The generation of a daemon is incremented within every transaction that changes the daemon, its plugins or its results,
+    so the generation read from the database identifies the committed state of the daemon across all processes.
+    """
+    __tablename__ = "generation"
+
+    daemon = database.Column(database.String(20), primary_key=True)
+    generation = database.Column(database.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"{self.daemon}#{self.generation}"
+
+    @staticmethod
+    def current(daemon):
+        """ Return the committed generation of a daemon, 0 if the daemon has never been changed. """
+        return database.session.execute(_select_generation, {"b_daemon": daemon}).scalar() or 0
+
+    @staticmethod
+    def changed(session):
+        """ Return the daemons changed by the current transaction of the session. """
+        return session.info.get("trident_changed_daemons", set())
+
+
+_index, _value, _latest, _rollup, _result = ResultIndex.__table__, ResultValue.__table__, LatestResult.__table__, ResultRollup.__table__, Result.__table__
+_generation = Generation.__table__
+
+# The statements maintaining the projections of the results are constructed once and executed with parameters,
+# since they are executed for every result that is inserted or deleted.
+_delete_index = _index.delete().where(
+    (_index.c.daemon == bindparam("b_daemon")) & (_index.c.plugin_name == bindparam("b_plugin_name")) & (_index.c.index == bindparam("b_index"))
+)
+_insert_index = _index.insert()
+_delete_value = _value.delete().where(
+    (_value.c.daemon == bindparam("b_daemon")) & (_value.c.plugin_name == bindparam("b_plugin_name")) & (_value.c.index == bindparam("b_index"))
+)
+_insert_value = _value.insert()
+_latest_key = (_latest.c.daemon == bindparam("b_daemon")) & (_latest.c.plugin_name == bindparam("b_plugin_name"))
+_select_latest = database.select(_latest.c.index).where(_latest_key)
+_update_latest = _latest.update().where(_latest_key & (_latest.c.index <= bindparam("b_index"))).values(
+    index=bindparam("b_index"), result=bindparam("b_result", type_=_latest.c.result.type)
+)
+_replace_latest = _latest.update().where(_latest_key).values(
+    index=bindparam("b_index"), result=bindparam("b_result", type_=_latest.c.result.type)
+)
+_insert_latest = _latest.insert()
+_delete_latest = _latest.delete().where(_latest_key)
+_select_previous = database.select(_result.c.index, _result.c.result).where(
+    (_result.c.daemon == bindparam("b_daemon")) & (_result.c.plugin_name == bindparam("b_plugin_name"))
+).order_by(_result.c.index.desc()).limit(1)
+_update_rollup = _rollup.update().where(
+    (_rollup.c.resolution == bindparam("b_resolution")) & (_rollup.c.daemon == bindparam("b_daemon")) &
+    (_rollup.c.plugin_name == bindparam("b_plugin_name")) & (_rollup.c.bucket == bindparam("b_bucket", type_=_rollup.c.bucket.type))
+).values(runs=_rollup.c.runs + 1, non_null=_rollup.c.non_null + bindparam("b_non_null"))
+_insert_rollup = _rollup.insert()
+_select_generation = database.select(_generation.c.generation).where(_generation.c.daemon == bindparam("b_daemon"))
+_update_generation = _generation.update().where(_generation.c.daemon == bindparam("b_daemon")).values(
+    generation=_generation.c.generation + 1
+)
+_insert_generation = _generation.insert()
+GENERATION_MODELS = (Daemon, ConnectedDaemon, Plugin, Result)
+
+
+def delete_result_entries(connection, target):
+    """ Delete the values and entries of a result from the inverted index. """
+    parameters = {"b_daemon": target.daemon, "b_plugin_name": target.plugin_name, "b_index": int(target.index)}
+    connection.execute(_delete_index, parameters)
+    connection.execute(_delete_value, parameters)
+
+def insert_result_entries(connection, target):
+    """ Insert the values of a result and an entry for every term of the values to the inverted index. """
+    result = {"index": int(target.index), "plugin_name": target.plugin_name, "daemon": target.daemon}
+    values = ResultIndex.values(target.result)
+    if values:
+        connection.execute(_insert_value, [{"key": key, "value": value, **result} for key, value in values.items()])
+        connection.execute(_insert_index, [
+            {"term": term, "key": key, **result} for key, value in values.items() for term in ResultIndex.terms(value)
+        ])
+
+@event.listens_for(Result, "after_insert")
+def index_inserted_result(mapper, connection, target):
+    """ Index an inserted result within the same transaction as the result. """
+    insert_result_entries(connection, target)
+
+@event.listens_for(Result, "after_update")
+def index_updated_result(mapper, connection, target):
+    """ Re-index an updated result within the same transaction as the result. """
+    delete_result_entries(connection, target)
+    insert_result_entries(connection, target)
+
+@event.listens_for(Result, "after_delete")
+def index_deleted_result(mapper, connection, target):
+    """ Remove a deleted result from the index within the same transaction as the result. """
+    delete_result_entries(connection, target)
+
+@event.listens_for(Result, "after_insert")
+@event.listens_for(Result, "after_update")
+def update_latest_result(mapper, connection, target):
+    """ Replace the latest result of the daemon and plugin if the result has the same or a higher run index. """
+    parameters = {"b_daemon": target.daemon, "b_plugin_name": target.plugin_name, "b_index": int(target.index), "b_result": target.result}
+    if connection.execute(_update_latest, parameters).rowcount:
+        return
+
+    if connection.execute(_select_latest, parameters).first() is None:
+        connection.execute(_insert_latest, {"daemon": target.daemon, "plugin_name": target.plugin_name, "index": int(target.index), "result": target.result})
+
+@event.listens_for(Result, "after_delete")
+def delete_latest_result(mapper, connection, target):
+    """ Replace the latest result of the daemon and plugin with the previous result if the latest result was deleted. """
+    parameters = {"b_daemon": target.daemon, "b_plugin_name": target.plugin_name}
+    if connection.execute(_select_latest, parameters).scalar() != int(target.index):
+        return
+
+    previous = connection.execute(_select_previous, parameters).first()
+    if previous is None:
+        connection.execute(_delete_latest, parameters)
+    else:
+        connection.execute(_replace_latest, {**parameters, "b_index": previous.index, "b_result": previous.result})
+
+@event.listens_for(Result, "after_insert")
+def rollup_result(mapper, connection, target):
+    """ Count an inserted result in its buckets at every resolution within the same transaction as the result. """
+    non_null = int(any(True for _ in ResultIndex.entries(target.result)))
+    for resolution in ResultRollup.RESOLUTIONS:
+        bucket = ResultRollup.truncate(target.timestamp, resolution)
+        parameters = {"b_resolution": resolution, "b_daemon": target.daemon, "b_plugin_name": target.plugin_name, "b_bucket": bucket, "b_non_null": non_null}
+        if not connection.execute(_update_rollup, parameters).rowcount:
+            connection.execute(_insert_rollup, {
+                "resolution": resolution, "daemon": target.daemon, "plugin_name": target.plugin_name, "bucket": bucket, "runs": 1, "non_null": non_null
+            })
+
+@event.listens_for(Session, "after_flush")
+def increment_generations(session, flush_context):
+    """ Increment the generation of every daemon changed by the flush within the same transaction, once per flush. """
+    daemons = {
+        instance.daemon for instances in (session.new, session.dirty, session.deleted)
+        for instance in instances if isinstance(instance, GENERATION_MODELS)
+    }
+    daemons.discard(None)
+    if not daemons:
+        return
+
+    connection = session.connection()
+    for daemon in daemons:
+        if not connection.execute(_update_generation, {"b_daemon": daemon}).rowcount:
+            connection.execute(_insert_generation, {"daemon": daemon, "generation": 1})
+    session.info.setdefault("trident_changed_daemons", set()).update(daemons)
+
+@event.listens_for(Session, "after_transaction_end")
+def reset_changed_daemons(session, transaction):
+    """ Forget the daemons changed by a transaction once it has been committed or rolled back. """
+    if transaction.parent is None:
+        session.info.pop("trident_changed_daemons", None)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Trident: Profiler Module.
+Opt-in instrumentation of the database queries using SQLAlchemy engine events.
+
+Enabled by 'QUERY_PROFILING', every query records its statement, duration, rows and originating endpoint.
+Queries slower than 'SLOW_QUERY_THRESHOLD' seconds are logged together with their query plan and statements
+executed at least 'N_PLUS_ONE_THRESHOLD' times within one request are logged as N+1 patterns.
+
+@author: Jacob Wahlman
+"""
+
+from threading import Lock
+from time import perf_counter
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+from trident.database.models import database
+
+_load_listener = None
+
+
+class QueryStatistics:
+    """ Aggregated per-process statistics of the queries, keyed by endpoint and statement. """
+
+    def __init__(self):
+        self.records = {}
+        self._lock = Lock()
+
+    def add(self, endpoint, statement, duration, rows):
+        """ Add an executed query to the statistics. """
+        with self._lock:
+            record = self.records.setdefault((endpoint, statement), {"count": 0, "duration": 0.0, "max_duration": 0.0, "rows": 0, "n_plus_one": 0})
+            record["count"] += 1
+            record["duration"] += duration
+            record["max_duration"] = max(record["max_duration"], duration)
+            record["rows"] += rows
+
+    def add_n_plus_one(self, endpoint, statement):
+        """ Count a request that executed the statement as an N+1 pattern. """
+        with self._lock:
+            self.records[(endpoint, statement)]["n_plus_one"] += 1
+
+    @property
+    def serialize(self):
+        """ Return the statistics as a list of dictionaries ordered by the total duration. """
+        with self._lock:
+            return sorted((
+                {"endpoint": endpoint, "statement": statement, **record}
+                for (endpoint, statement), record in self.records.items()
+            ), key=lambda record: record["duration"], reverse=True)
+
+
+def explain(cursor, statement, parameters, dialect):
+    """ Return the query plan of a statement using a separate cursor on the same connection. """
+    prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+    explain_cursor = cursor.connection.cursor()
+    try:
+        explain_cursor.execute(prefix + statement, parameters)
+        return [tuple(row) for row in explain_cursor.fetchall()]
+    finally:
+        explain_cursor.close()
+
+def init_profiler(app):
+    """ Register the query instrumentation on the database engine of the application if 'QUERY_PROFILING' is enabled. """
+    if not app.config.get("QUERY_PROFILING", False):
+        return
+
+    statistics = app.extensions["trident_query_statistics"] = QueryStatistics()
+    threshold = app.config.get("SLOW_QUERY_THRESHOLD", 0.1)
+    n_plus_one_threshold = app.config.get("N_PLUS_ONE_THRESHOLD", 5)
+    with app.app_context():
+        engine = database.engine
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault("query_start", []).append(perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        duration = perf_counter() - connection.info["query_start"].pop()
+        endpoint = request.endpoint if has_request_context() else None
+        query = {"statement": statement, "duration": duration, "rows": max(cursor.rowcount, 0), "endpoint": endpoint}
+        app.logger.debug(f"Query executed in {duration:.6f}s from endpoint: '{endpoint}': {statement}")
+
+        if duration >= threshold and not executemany and statement.lstrip().upper().startswith("SELECT"):
+            try:
+                plan = explain(cursor, statement, parameters, engine.dialect.name)
+            except Exception as e:
+                plan = f"unavailable: {e}"
+            app.logger.warning(f"Slow query executed in {duration:.6f}s from endpoint: '{endpoint}': {statement} with plan: {plan}")
+
+        if has_request_context():
+            g.setdefault("queries", []).append(query)
+        else:
+            statistics.add(endpoint, statement, duration, query["rows"])
+
+    global _load_listener
+    if _load_listener is None:
+        @event.listens_for(database.Model, "load", propagate=True)
+        def _load_listener(target, context):
+            """ Count the rows loaded by the ORM towards the latest query of the request. """
+            if has_request_context() and g.get("queries"):
+                g.queries[-1]["rows"] += 1
+
+    @app.after_request
+    def report_queries(response):
+        queries = g.pop("queries", [])
+        counts = {}
+        for query in queries:
+            statistics.add(query["endpoint"], query["statement"], query["duration"], query["rows"])
+            counts[query["statement"]] = counts.get(query["statement"], 0) + 1
+
+        for statement, count in counts.items():
+            if count >= n_plus_one_threshold:
+                statistics.add_n_plus_one(request.endpoint, statement)
+                app.logger.warning(f"Possible N+1 pattern in endpoint: '{request.endpoint}', statement executed {count} times: {statement}")
+
+        response.headers["X-Query-Count"] = str(len(queries))
+        response.headers["X-Query-Duration"] = f"{sum(query['duration'] for query in queries):.6f}"
+        return response
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Trident: Server Module.
+Serves the dashboard using a pre-forking worker model.
+
+The listening socket is bound once in the parent process and shared by all workers,
+each worker creates its own application and therefore its own database engine and connection pool.
+Any state kept by the application like caches and counters is per-process.
+Workers that exit unexpectedly are replaced, with an exponential backoff while they keep failing shortly after starting,
+and the server stops after 'MAX_STARTUP_FAILURES' consecutive failed starts.
+
+@author: Jacob Wahlman
+"""
+
+import os
+import signal
+import socket
+import traceback
+from argparse import ArgumentParser
+from time import sleep, monotonic
+
+from flask import Config
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+STARTUP_GRACE = 5.0
+RESPAWN_BACKOFF = 0.1
+MAX_RESPAWN_BACKOFF = 30.0
+MAX_STARTUP_FAILURES = 5
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """ Request handler that only logs failed requests. """
+
+    def log_request(self, code="-", size="-"):
+        if str(code).startswith(("4", "5")):
+            super().log_request(code, size)
+
+
+def bind_socket(host, port, backlog=1024):
+    """ Bind and listen on the given address, the returned socket is inherited by the workers. """
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def run_worker(sock, config=None):
+    """ Create the application in the worker process and serve requests from the shared socket.
+    The worker exits with status 1 if creating the application or serving fails, otherwise 0.
+    """
+    status = 1
+    try:
+        from trident import create_app
+
+        app = create_app(config)
+        host, port = sock.getsockname()[:2]
+        server = make_server(host, port, app, request_handler=QuietRequestHandler, fd=sock.fileno())
+        server.serve_forever()
+        status = 0
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        os._exit(status)
+
+def spawn_worker(sock, config=None):
+    """ Fork a new worker process and return its process id. """
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        run_worker(sock, config)
+    return pid
+
+def worker_failed(status):
+    """ Return whether the wait status of a worker is a failure, i.e. it exited non-zero or was killed by a signal. """
+    return not (os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0)
+
+def serve(host="127.0.0.1", port=5000, workers=None, config=None):
+    """ Serve the dashboard with the given amount of pre-forked workers, defaults to one per core.
+    The parent process never creates the application, it only supervises the workers and replaces any
+    worker that exits unexpectedly until it receives SIGINT or SIGTERM. A worker that fails within 'STARTUP_GRACE'
+    seconds is replaced after an exponential backoff and after 'MAX_STARTUP_FAILURES' such failures in a row
+    the workers are stopped and RuntimeError is raised.
+    """
+    from trident import ROOT_DIR, load_config
+    from trident.database.handler import MEMORY_DATABASE_URIS
+
+    workers = workers or os.cpu_count() or 1
+    uri = load_config(Config(ROOT_DIR), config)["SQLALCHEMY_DATABASE_URI"]
+    if workers > 1 and uri in MEMORY_DATABASE_URIS:
+        raise ValueError("An in-memory database can not be shared between multiple workers")
+
+    sock = bind_socket(host, port)
+    print(f"Listening on http://{sock.getsockname()[0]}:{sock.getsockname()[1]} with {workers} worker(s)", flush=True)
+
+    running = True
+    def stop(signum, frame):
+        nonlocal running
+        running = False
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    pids = {spawn_worker(sock, config): monotonic() for _ in range(workers)}
+    respawns, failures = [], 0
+    try:
+        while running:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid in pids:
+                started = pids.pop(pid)
+                failures = failures + 1 if worker_failed(status) and monotonic() - started < STARTUP_GRACE else 0
+                if failures >= MAX_STARTUP_FAILURES:
+                    raise RuntimeError(f"Workers failed to start {failures} times in a row, stopping")
+
+                backoff = min(RESPAWN_BACKOFF * 2 ** (failures - 1), MAX_RESPAWN_BACKOFF) if failures else 0
+                respawns.append(monotonic() + backoff)
+
+            for respawn in [respawn for respawn in respawns if respawn <= monotonic()]:
+                respawns.remove(respawn)
+                pids[spawn_worker(sock, config)] = monotonic()
+            sleep(0.1)
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        sock.close()
+
+def main(argv=None):
+    """ Command line entry point for serving the dashboard with pre-forked workers. """
+    parser = ArgumentParser(prog="trident-dashboard", description="Serve the Trident Dashboard using pre-forked workers.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=5000, help="Port to listen on, 0 picks a free port")
+    parser.add_argument("--workers", type=int, default=None, help="Amount of worker processes, defaults to the amount of cores")
+    parser.add_argument("--database", default=None, help="SQLAlchemy database URI used by the workers")
+    args = parser.parse_args(argv)
+
+    config = {"SQLALCHEMY_DATABASE_URI": args.database} if args.database else None
+    try:
+        serve(host=args.host, port=args.port, workers=args.workers, config=config)
+    except (ValueError, RuntimeError) as e:
+        parser.exit(1, f"{parser.prog}: {e}\n")
+
+
+if __name__ == "__main__":
+    main()